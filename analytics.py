@@ -0,0 +1,143 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from db import get_recent_weekly_scores, get_latest_weekly_date, iso_week
+from transforms import SUBJECT_EMOJIS
+
+# ──────────────────────── Константы ────────────────────────
+MOVING_WEEKS = 4   # окно скользящего среднего, календарных недель
+
+# ──────────────────────── Расчёт и кэш ────────────────────────
+# Из БД берутся только последние MOVING_WEEKS недель (по индексу на дату), дальше всё
+# векторно: матрица (ученик, предмет) × неделя, среднее и изменение — по строкам,
+# места и перцентили — ранжированием внутри предмета. Оконные функции SQLite на тех же
+# данных в несколько раз медленнее. Результат кэшируется до новой даты в БД или
+# явного сброса после загрузки.
+
+_lock = threading.Lock()
+_EMPTY = {'date': None, 'students': {}, 'distribution': {}}
+_cache = {'valid': False, 'result': _EMPTY}
+
+
+def invalidate():
+    """Сбрасывает кэш — вызывается после записи новых недельных результатов."""
+    with _lock:
+        _cache['valid'] = False
+
+
+def _student_stats(rows: list) -> pd.DataFrame:
+    """Показатели за последнюю неделю: name, subject, value, moving_avg, delta, rank, class_size, percentile."""
+    df = pd.DataFrame(rows, columns=['date', 'name', 'subject', 'value'])
+    # одна неделя — одна колонка: из нескольких дат недели берётся самая поздняя оценка
+    df['week'] = df['date'].map({d: iso_week(d) for d in df['date'].unique()})
+    df = df.sort_values('date').drop_duplicates(['name', 'subject', 'week'], keep='last')
+    wide = df.set_index(['name', 'subject', 'week'])['value'].unstack('week').sort_index(axis=1)
+    latest = wide.iloc[:, -1]
+    if wide.shape[1] > 1:
+        previous = wide.iloc[:, :-1].ffill(axis=1).iloc[:, -1]  # последняя оценка до этой недели
+    else:
+        previous = pd.Series(np.nan, index=wide.index)
+
+    stats = pd.DataFrame({
+        'value': latest,
+        'moving_avg': wide.mean(axis=1),
+        'delta': latest - previous,
+    })[latest.notna()].reset_index()
+
+    by_subject = stats.groupby('subject')['value']
+    stats['rank'] = by_subject.rank(method='min', ascending=False).astype(int)
+    stats['class_size'] = by_subject.transform('size').astype(int)
+    below = by_subject.rank(method='min') - 1
+    stats['percentile'] = (below / (stats['class_size'] - 1)).where(stats['class_size'] > 1, 0.0)
+    return stats
+
+
+def _compute() -> dict:
+    rows = get_recent_weekly_scores(MOVING_WEEKS)
+    if not rows:
+        return dict(_EMPTY)
+
+    stats = _student_stats(rows)
+    students = {}
+    for name, subject, value, moving_avg, delta, rank, class_size, percentile in zip(
+            stats['name'], stats['subject'], stats['value'], stats['moving_avg'], stats['delta'],
+            stats['rank'], stats['class_size'], stats['percentile']):
+        students.setdefault(name, {})[subject] = {
+            'value': value, 'moving_avg': moving_avg,
+            'delta': None if pd.isna(delta) else delta,
+            'rank': int(rank), 'class_size': int(class_size), 'percentile': percentile,
+        }
+
+    by_subject = stats.groupby('subject', sort=True)
+    summary = by_subject['value'].describe(percentiles=[0.25, 0.5, 0.75])
+    up = (stats['delta'] > 0).groupby(stats['subject']).sum()
+    down = (stats['delta'] < 0).groupby(stats['subject']).sum()
+    distribution = {
+        subject: {
+            'count': int(row['count']), 'mean': row['mean'], 'min': row['min'], 'max': row['max'],
+            'q1': row['25%'], 'median': row['50%'], 'q3': row['75%'],
+            'improved': int(up[subject]), 'declined': int(down[subject]),
+        }
+        for subject, row in summary.iterrows()
+    }
+    return {'date': max(r[0] for r in rows), 'students': students, 'distribution': distribution}
+
+
+def get_class_analytics() -> dict:
+    """{'date', 'students': {имя: {предмет: показатели}}, 'distribution': {предмет: статистика}}."""
+    latest = get_latest_weekly_date()
+    with _lock:
+        if _cache['valid'] and _cache['result']['date'] == latest:
+            return _cache['result']
+    result = _compute()
+    with _lock:
+        _cache.update(valid=True, result=result)
+    return result
+
+
+def get_student_trend(name: str):
+    """(дата, {предмет: показатели}) для ученика; показателей нет — пустой словарь."""
+    analytics = get_class_analytics()
+    return analytics['date'], analytics['students'].get(str(name).strip().lower(), {})
+
+# ──────────────────────── Тексты ────────────────────────
+
+def _delta_label(delta) -> str:
+    if delta is None:
+        return "—"
+    if round(delta) == 0:
+        return "＝"
+    return f"▲ +{round(delta)}" if delta > 0 else f"▼ −{round(-delta)}"
+
+
+def format_trend(name: str, date, subjects: dict) -> str:
+    """Ответ родителю: оценка, изменение, скользящее среднее и место в классе по предметам."""
+    if not subjects:
+        return f"📭 Нет данных о динамике для {name}."
+    text = f"📈 *Динамика для {name}* (неделя {date})\n\n"
+    for subject, s in subjects.items():
+        emoji = SUBJECT_EMOJIS.get(subject, '🔹')
+        text += (
+            f"{emoji} {subject.capitalize()}: {round(s['value'])}% ({_delta_label(s['delta'])})\n"
+            f"    среднее за {MOVING_WEEKS} нед.: {round(s['moving_avg'])}%, "
+            f"место {s['rank']} из {s['class_size']} (выше {round(s['percentile'] * 100)}% класса)\n"
+        )
+    return text
+
+
+def format_class_summary(analytics: dict) -> str:
+    """Сводка для администратора: распределение оценок класса по предметам."""
+    if not analytics['distribution']:
+        return "📭 В базе нет недельных результатов."
+    text = f"🏫 *Сводка класса* (неделя {analytics['date']}, учеников: {len(analytics['students'])})\n"
+    for subject, d in analytics['distribution'].items():
+        emoji = SUBJECT_EMOJIS.get(subject, '🔹')
+        text += (
+            f"\n{emoji} *{subject.capitalize()}* ({d['count']})\n"
+            f"    среднее {d['mean']:.0f}%, медиана {d['median']:.0f}%\n"
+            f"    Q1–Q3: {d['q1']:.0f}–{d['q3']:.0f}%, min–max: {d['min']:.0f}–{d['max']:.0f}%\n"
+            f"    ▲ выросли: {d['improved']}, ▼ снизились: {d['declined']}\n"
+        )
+    return text
@@ -0,0 +1,69 @@
+"""
+Время рендера одного PDF-отчёта: как раньше (add_font + полная сборка
+подмножества шрифта на каждый отчёт) и с предзагруженным шрифтом.
+
+Запуск из корня проекта:  python -m benchmarks.bench_pdf [-n 50]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import fpdf.fpdf
+from fpdf.ttfonts import TTFontFile
+
+import report
+from report import PDFReport, FONT_NAME, FONT_PATH
+
+
+class LegacyPDFReport(PDFReport):
+    """Старый путь: каждый отчёт сам вызывает add_font и читает TTF."""
+
+    def add_shared_font(self, style=''):
+        self.add_font(FONT_NAME, style, FONT_PATH, uni=True)
+
+
+def sample_records(weeks=20):
+    return [
+        {'date': f"2024-{1 + i // 4:02d}-{1 + (i % 4) * 7:02d}",
+         'subjects': {'таджикский язык': 81.0, 'биология': 64.0, 'физика': 70.0,
+                      'химия': 55.0, 'общий процент': 68.0}}
+        for i in range(weeks)
+    ]
+
+
+def _time(cls, n, records, out_path):
+    timings = []
+    for i in range(n):
+        started = time.perf_counter()
+        pdf = cls(report_type='weekly')
+        pdf.add_page()
+        pdf.add_student_results(f"Ученик Тестовый {i}", records)
+        pdf.output(out_path)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {'mean_ms': 1000 * sum(timings) / n, 'p50_ms': 1000 * timings[n // 2], 'max_ms': 1000 * timings[-1]}
+
+
+def run(n=50) -> dict:
+    records = sample_records()
+    out_path = os.path.join(tempfile.mkdtemp(), 'bench.pdf')
+
+    fpdf.fpdf.TTFontFile = TTFontFile  # без кэша подмножеств
+    before = _time(LegacyPDFReport, n, records, out_path)
+
+    fpdf.fpdf.TTFontFile = report._CachedTTFontFile
+    report.preload_fonts()
+    after = _time(PDFReport, n, records, out_path)
+    return {'reports': n, 'before': before, 'after': after,
+            'speedup': round(before['mean_ms'] / after['mean_ms'], 1)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', type=int, default=50, help='число отчётов')
+    result = run(parser.parse_args().n)
+    for label in ('before', 'after'):
+        r = result[label]
+        print(f"{label:>6}: среднее {r['mean_ms']:.1f} мс, p50 {r['p50_ms']:.1f} мс, макс {r['max_ms']:.1f} мс")
+    print(f"Ускорение: ×{result['speedup']}")
@@ -0,0 +1,77 @@
+"""
+Подготовка еженедельных результатов (проценты, тексты, строки для БД):
+построчный iterrows, как было раньше, против векторного transforms.
+
+Запуск из корня проекта:  python -m benchmarks.bench_transforms [-n 5000]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from transforms import weekly_summaries, format_weekly_results, format_weekly_broadcast
+
+SUBJECTS = ['Таджикский язык', 'Биология', 'Физика', 'Химия', 'Общий процент']
+
+
+def make_weekly_df(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'Имя ученика': [f"Ученик {i}" for i in range(n)],
+        'Телефон родителя': [f"{900000000 + i}" for i in range(n)],
+    })
+    for subject in SUBJECTS:
+        df[subject] = rng.random(n).round(2)
+    return df
+
+
+def legacy(df: pd.DataFrame):
+    """Старый путь: iterrows + drop/astype/to_dict и форматирование на каждую строку."""
+    out = []
+    for _, row in df.iterrows():
+        name = row['Имя ученика']
+        results = row.drop(['Имя ученика', 'Телефон родителя'], errors='ignore').astype(float).to_dict()
+        results_percent = {k: round(v * 100) for k, v in results.items()}
+        broadcast = f"📅 Итоги недели для *{name}*:\n\n" + "\n".join(
+            f"🧪 {subject.strip()}: {score}%" for subject, score in results_percent.items())
+        labels = {}
+        for subject, mark in row.drop(['Имя ученика', 'Телефон родителя'], errors='ignore').items():
+            percent = float(mark)
+            labels[subject.strip().lower()] = f"{round(percent * 100)}%" if percent <= 1 else f"{round(percent)}%"
+        out.append((results, broadcast, format_weekly_results(name, labels)))
+    return out
+
+
+def vectorized(df: pd.DataFrame):
+    return [
+        (s['values'], format_weekly_broadcast(s['name'], s['labels']), format_weekly_results(s['name'], s['labels']))
+        for s in weekly_summaries(df)
+    ]
+
+
+def _best_of(fn, df, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(df)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(n=5000, repeat=3) -> dict:
+    df = make_weekly_df(n)
+    before = _best_of(legacy, df, repeat)
+    after = _best_of(vectorized, df, repeat)
+    return {'students': n, 'before_s': round(before, 4), 'after_s': round(after, 4),
+            'speedup': round(before / after, 1)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', type=int, default=5000, help='число учеников')
+    result = run(parser.parse_args().n)
+    print(f"Учеников: {result['students']}")
+    print(f"iterrows:  {result['before_s']:.3f} с")
+    print(f"векторно:  {result['after_s']:.3f} с")
+    print(f"Ускорение: ×{result['speedup']}")
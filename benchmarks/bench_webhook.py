@@ -0,0 +1,120 @@
+"""
+Задержка «обновление → ответ» в режиме webhook, офлайн: обновления
+отправляются POST-запросами в webhook-приложение, ответы бота принимает
+локальный FakeTelegram. Обработчик, как /results, ходит в БД через run_io.
+
+Запуск из корня проекта:  python -m benchmarks.bench_webhook [-n 1000] [-c 100]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+from telebot.async_telebot import AsyncTeleBot
+
+import db
+from runtime import run_io, shutdown
+from utils import get_binding
+from webhook import create_app, WEBHOOK_PATH, SECRET_HEADER
+from benchmarks.fake_telegram import FakeTelegram, use_fake_api
+
+SECRET = 'bench-secret'
+
+
+def make_bot() -> AsyncTeleBot:
+    bot = AsyncTeleBot('123:bench')
+
+    @bot.message_handler(commands=['results'])
+    async def handle_results(message):
+        phone = await run_io(get_binding, str(message.chat.id))
+        await bot.send_message(message.chat.id, f"📊 {phone or 'нет привязки'}")
+
+    return bot
+
+
+def make_update(n: int) -> dict:
+    chat_id = 1000 + n
+    return {'update_id': n, 'message': {
+        'message_id': n, 'date': int(time.time()), 'text': '/results',
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Родитель'},
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': 8}],
+    }}
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(n: int, concurrency: int):
+    fake = FakeTelegram()
+    await fake.start()
+    use_fake_api(fake.url)
+
+    bot = make_bot()
+    runner = web.AppRunner(create_app(bot, SECRET))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}{WEBHOOK_PATH}"
+
+    sent_at, acks, rejected = {}, [], [0]
+    limit = asyncio.Semaphore(concurrency)
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json=make_update(0)) as resp:
+            assert resp.status == 403, "запрос без секрета должен отклоняться"
+
+        async def post(i):
+            async with limit:
+                sent_at[1000 + i] = time.perf_counter()
+                while True:
+                    started = time.perf_counter()
+                    async with session.post(url, json=make_update(i), headers={SECRET_HEADER: SECRET}) as resp:
+                        acks.append(time.perf_counter() - started)
+                        if resp.status == 200:
+                            break
+                        # очередь полна — как и Telegram, повторяем доставку позже
+                        assert resp.status == 503, resp.status
+                        rejected[0] += 1
+                    await asyncio.sleep(0.05)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(i) for i in range(1, n + 1)))
+        await fake.wait_for(n)
+        total = time.perf_counter() - started
+
+    latencies = [(t - sent_at[int(params['chat_id'])]) * 1000 for t, params in fake.sent()]
+    print(f"Обновлений: {n}, параллельно: {concurrency}, всего {total:.2f} с ({n / total:.0f}/с), "
+          f"отказов 503: {rejected[0]}")
+    print(f"  подтверждение webhook, мс: p50 {statistics.median(acks) * 1000:.1f}, "
+          f"p95 {_percentile(acks, 0.95) * 1000:.1f}")
+    print(f"  обновление → ответ, мс:    p50 {statistics.median(latencies):.1f}, "
+          f"p95 {_percentile(latencies, 0.95):.1f}, max {max(latencies):.1f}")
+
+    await runner.cleanup()
+    await bot.close_session()
+    await fake.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=1000, help="число обновлений")
+    parser.add_argument('-c', type=int, default=100, help="одновременных запросов")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, 'bench.db')
+        db.init_db()
+        try:
+            asyncio.run(run(args.n, args.c))
+        finally:
+            shutdown()
+
+
+if __name__ == '__main__':
+    main()
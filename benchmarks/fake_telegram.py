@@ -0,0 +1,102 @@
+"""
+Локальная подмена Telegram Bot API для офлайн-тестов и замеров.
+Отвечает на любые методы как настоящий сервер ({"ok": true, "result": ...})
+и запоминает вызовы с временем получения.
+
+    fake = FakeTelegram()
+    await fake.start()
+    use_fake_api(fake.url)        # AsyncTeleBot теперь ходит в fake
+    ...
+    await fake.stop()
+"""
+import asyncio
+import itertools
+import time
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+from telebot import asyncio_helper
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+
+
+def use_fake_api(url: str):
+    """Направляет асинхронный клиент pyTelegramBotAPI на локальный сервер."""
+    asyncio_helper.API_URL = url + '/bot{0}/{1}'
+
+
+class FakeTelegram:
+    """Мини-сервер Bot API: calls — [(время, метод, параметры)]."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.host = host
+        self.port = port
+        self.calls = []
+        self.runner = None
+        self._ids = itertools.count(1)
+        self._changed = asyncio.Event()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self._handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def _handle(self, request):
+        method = request.match_info['method']
+        params = dict(request.query)
+        params.update(await self._read_params(request))
+        self.calls.append((time.perf_counter(), method, params))
+        self._changed.set()
+        return web.json_response({'ok': True, 'result': self._result(method, params)})
+
+    @staticmethod
+    async def _read_params(request) -> dict:
+        # клиент шлёт multipart-форму даже в GET-запросах, request.post() её не разбирает
+        if not request.can_read_body:
+            return {}
+        if request.content_type == 'multipart/form-data':
+            params = {}
+            reader = await request.multipart()
+            while (part := await reader.next()) is not None:
+                params[part.name] = await part.text() if part.filename is None else await part.read()
+            return params
+        return dict(parse_qsl((await request.read()).decode()))
+
+    def _result(self, method: str, params: dict):
+        if method == 'getMe':
+            return BOT_USER
+        if method.startswith('send') or method.startswith('edit'):
+            chat_id = int(params.get('chat_id', 0))
+            message = {'message_id': next(self._ids), 'date': int(time.time()),
+                       'chat': {'id': chat_id, 'type': 'private'}, 'from': BOT_USER}
+            if 'text' in params:
+                message['text'] = params['text']
+            return message
+        return True
+
+    def sent(self, method: str = 'sendMessage') -> list:
+        return [(t, params) for t, m, params in self.calls if m == method]
+
+    async def wait_for(self, count: int, method: str = 'sendMessage', timeout: float = 30.0):
+        """Ждёт, пока fake получит count вызовов method."""
+        deadline = time.perf_counter() + timeout
+        while len(self.sent(method)) < count:
+            self._changed.clear()
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise TimeoutError(f"{method}: {len(self.sent(method))} из {count}")
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
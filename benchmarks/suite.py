@@ -0,0 +1,203 @@
+"""
+Сквозной замер на синтетических данных школы: загрузка Excel в БД,
+чтение списка и месячного листа, выборки истории, PDF и рассылка через
+фиктивного бота — для 100 / 1000 / 10000 учеников. Итоги пишутся в JSON,
+который можно сравнить с прошлым прогоном.
+
+Запуск из корня проекта:
+    python -m benchmarks.suite [--sizes 100 1000 10000] [--years 2] [--out bench.json]
+    python -m benchmarks.suite --sizes 1000 --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import date, datetime
+
+import broadcast
+import db
+import report
+import utils
+from broadcast import drain_outbox
+from db import enqueue_outbox, upsert_bindings, get_all_weekly_results, get_histories
+from ingest import ingest_workbook
+from transforms import format_weekly_broadcast
+from benchmarks.synthetic import (write_weekly_xlsx, write_monthly_xlsx, populate_history,
+                                  student_name)
+
+SIZES = (100, 1000, 10000)
+LOOKUPS = 200        # выборок get_all_weekly_results на размер
+PDF_SAMPLE = 20      # PDF на размер (рендер линейный, больше не нужно)
+REGRESSION = 1.2     # во сколько раз медленнее базового считается регрессией
+
+
+class MockBot:
+    """Бот без сети: send_message только считает и при желании ждёт latency секунд."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = 0
+
+    def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        self.sent += 1
+
+
+class Timer:
+    def __init__(self):
+        self.timings = {}
+
+    def __call__(self, step: str):
+        timer = self
+
+        class _Step:
+            def __enter__(self):
+                self.started = time.perf_counter()
+
+            def __exit__(self, *exc):
+                timer.timings[step] = round(time.perf_counter() - self.started, 4)
+
+        return _Step()
+
+
+def run_size(n: int, years: int, workdir: str, latency: float) -> dict:
+    weekly_path = os.path.join(workdir, 'weekly.xlsx')
+    monthly_path = os.path.join(workdir, 'monthly.xlsx')
+    db.DB_PATH = os.path.join(workdir, 'bench.db')
+    db.init_db()
+    utils.EXCEL_WEEKLY = weekly_path
+    utils.invalidate_roster()
+    utils.invalidate_bindings()
+    today = date.today().isoformat()
+    timer = Timer()
+
+    with timer('generate_xlsx'):
+        write_weekly_xlsx(weekly_path, n)
+        write_monthly_xlsx(monthly_path, n)
+
+    with timer('ingest_weekly'):
+        ingest_workbook(weekly_path, 'weekly', today)
+    with timer('reingest_weekly_unchanged'):
+        ingest_workbook(weekly_path, 'weekly', today)
+    with timer('ingest_monthly'):
+        ingest_workbook(monthly_path, 'monthly', today)
+
+    with timer('load_roster'):
+        utils.get_roster()
+    with timer('load_monthly_data'):
+        utils.load_monthly_data(monthly_path)
+
+    with timer('populate_history'):
+        rows = populate_history(n, years)
+
+    sample = random.Random(0).sample(range(n), min(n, LOOKUPS))
+    with timer('get_all_weekly_results'):
+        for i in sample:
+            get_all_weekly_results(student_name(i).lower())
+    with timer('get_histories_class'):
+        histories = get_histories()
+
+    pdf_sample = sample[:PDF_SAMPLE] if os.path.exists(report.FONT_PATH) else []
+    if pdf_sample:
+        with timer('pdf'):
+            for i in pdf_sample:
+                report.generate_progress_pdf(student_name(i), histories[student_name(i).lower()]['weekly'])
+    else:
+        print(f"⚠ Нет шрифта {report.FONT_PATH} — замер PDF пропущен")
+
+    bot = MockBot(latency)
+    with timer('broadcast'):
+        phones = {utils.clean_phone(str(p)) for p in utils.get_roster()['Телефон родителя']}
+        upsert_bindings((phone, phone) for phone in phones)  # chat_id = телефон
+        messages = []
+        for cid, phone in utils.load_bindings().items():
+            for summary in utils.get_student_summaries(phone):
+                text = format_weekly_broadcast(summary['name'], summary['labels'])
+                messages.append((f"weekly:{cid}:{summary['name'].lower()}:{today}", cid, text, {}))
+        enqueue_outbox(messages)
+        drain_outbox(bot)
+
+    per_call = {'get_all_weekly_results': round(timer.timings['get_all_weekly_results'] / len(sample), 6)}
+    if pdf_sample:
+        per_call['pdf'] = round(timer.timings['pdf'] / len(pdf_sample), 4)
+    return {
+        'students': n,
+        'history_rows': rows,
+        'messages': bot.sent,
+        'timings': timer.timings,
+        'per_call': per_call,
+    }
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(results: dict, baseline: dict) -> list:
+    """[(размер, шаг, было, стало, отношение)] для шагов, есть в обоих прогонах."""
+    old = {run['students']: run['timings'] for run in baseline['runs']}
+    rows = []
+    for run in results['runs']:
+        for step, seconds in run['timings'].items():
+            before = old.get(run['students'], {}).get(step)
+            if before:
+                rows.append((run['students'], step, before, seconds, seconds / before))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help='число учеников')
+    parser.add_argument('--years', type=int, default=2, help='лет истории в БД')
+    parser.add_argument('--latency', type=float, default=0.0, help='сек на send_message у фиктивного бота')
+    parser.add_argument('--out', help='куда записать JSON с итогами')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    # лимиты Telegram к фиктивному боту не относятся — меряем сам конвейер рассылки
+    broadcast.GLOBAL_RATE = broadcast.GLOBAL_BURST = 1e9
+    broadcast.PER_CHAT_INTERVAL = 0.0
+
+    results = {
+        'meta': {'date': datetime.now().isoformat(timespec='seconds'), 'revision': _git_revision(),
+                 'python': platform.python_version(), 'machine': platform.machine(), 'years': args.years},
+        'runs': [],
+    }
+    for n in args.sizes:
+        workdir = tempfile.mkdtemp(prefix=f'bench_{n}_')
+        try:
+            run = run_size(n, args.years, workdir, args.latency)
+        finally:
+            db.close_connection()
+            shutil.rmtree(workdir, ignore_errors=True)
+        results['runs'].append(run)
+        print(f"\n👥 Учеников: {n}, строк истории: {sum(run['history_rows'].values())}")
+        for step, seconds in run['timings'].items():
+            print(f"  {step:<28} {seconds:>9.3f} с")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\n📊 Сравнение с {args.baseline} ({baseline['meta'].get('revision') or '?'})")
+        for n, step, before, after, ratio in compare(results, baseline):
+            mark = ' ⚠️' if ratio > REGRESSION else ''
+            print(f"  {n:>6} {step:<28} {before:>8.3f} → {after:>8.3f} с  ×{ratio:.2f}{mark}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Синтетические данные школы для замеров: weekly.xlsx и monthly.xlsx в тех же
+раскладках, что читают utils (в том числе фиксированные колонки месячного
+листа), и многолетняя история в weekly_results / results.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+from openpyxl import Workbook
+
+from db import connection, get_subject_ids
+from transforms import MONTHLY_MAXIMUMS
+from utils import MONTHLY_FIRST_ROW, MONTHLY_COLUMNS
+
+WEEKLY_SUBJECTS = ['Таджикский язык', 'Биология', 'Химия', 'Физика', 'Общий процент']
+
+
+def student_name(i: int) -> str:
+    return f"Ученик {i:05d}"
+
+
+def parent_phone(i: int) -> str:
+    # у каждого пятого родителя двое детей в классе
+    return f"{900000000 + (i - 1 if i % 5 == 1 else i)}"
+
+
+def write_weekly_xlsx(path: str, n: int, seed: int = 0):
+    """Еженедельный лист: заголовок + строка на ученика, оценки — доли от 0 до 1."""
+    rng = np.random.default_rng(seed)
+    marks = rng.random((n, len(WEEKLY_SUBJECTS))).round(2)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(['Имя ученика', 'Телефон родителя'] + WEEKLY_SUBJECTS)
+    for i in range(n):
+        ws.append([student_name(i), parent_phone(i)] + marks[i].tolist())
+    wb.save(path)
+
+
+def write_monthly_xlsx(path: str, n: int, seed: int = 0):
+    """
+    Ежемесячный лист: MONTHLY_FIRST_ROW строк шапки, затем ученики; баллы
+    в колонках MONTHLY_COLUMNS, промежуточные колонки заполнены как в оригинале.
+    """
+    rng = np.random.default_rng(seed + 1)
+    subjects = ['Таджикский язык', 'Биология', 'Химия', 'Физика']
+    width = max(MONTHLY_COLUMNS.values()) + 1
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(["Итоги месяца"] + [None] * (width - 1))
+    for _ in range(MONTHLY_FIRST_ROW - 1):
+        ws.append([None] * width)
+    for i in range(n):
+        row = [i + 1] + [None] * (width - 1)
+        row[MONTHLY_COLUMNS['Имя ученика']] = student_name(i)
+        total = 0
+        for subject in subjects:
+            col = MONTHLY_COLUMNS[subject]
+            score = int(rng.integers(0, MONTHLY_MAXIMUMS[subject] + 1))
+            row[col - 2], row[col - 1] = score // 2, score - score // 2  # части экзамена
+            row[col] = score
+            total += score
+        row[MONTHLY_COLUMNS['Общий балл']] = total
+        row[MONTHLY_COLUMNS['Общий процент']] = round(total / MONTHLY_MAXIMUMS['Общий балл'] * 100, 1)
+        ws.append(row)
+    wb.save(path)
+
+
+def populate_history(n: int, years: int = 2, seed: int = 0, end: date = None) -> dict:
+    """
+    История за years лет: еженедельные результаты каждое воскресенье
+    и ежемесячные в первый день месяца. Возвращает число вставленных строк.
+    """
+    rng = np.random.default_rng(seed + 2)
+    end = end or date.today()
+    weeks = [(end - timedelta(weeks=w)).isoformat() for w in range(years * 52)][::-1]
+    months = []
+    for m in range(years * 12):
+        year, month = divmod(end.year * 12 + end.month - 1 - m, 12)
+        months.append(date(year, month + 1, 1).isoformat())
+    months.reverse()
+    subjects = [s.lower() for s in WEEKLY_SUBJECTS]
+    monthly_subjects = [s.lower() for s in MONTHLY_MAXIMUMS]
+    ids = get_subject_ids(subjects + monthly_subjects)
+
+    with connection() as conn:
+        for day in weeks:
+            marks = rng.integers(0, 101, (n, len(subjects)))  # проценты, как хранит БД
+            conn.executemany(
+                "INSERT OR IGNORE INTO weekly_results (student_name, subject_id, mark, date) VALUES (?, ?, ?, ?)",
+                ((student_name(i).lower(), ids[subject], float(marks[i, j]), day)
+                 for i in range(n) for j, subject in enumerate(subjects)))
+        for day in months:
+            scores = rng.integers(0, 100, (n, len(monthly_subjects)))
+            conn.executemany(
+                "INSERT OR IGNORE INTO results (name, subject_id, score, date) VALUES (?, ?, ?, ?)",
+                ((student_name(i).lower(), ids[subject], float(scores[i, j]), day)
+                 for i in range(n) for j, subject in enumerate(monthly_subjects)))
+    return {'weekly': n * len(weeks) * len(subjects), 'monthly': n * len(months) * len(monthly_subjects)}
@@ -0,0 +1,209 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Tuple
+
+import requests
+from telebot.apihelper import ApiTelegramException
+
+from db import claim_outbox, mark_outbox_sent, mark_outbox_failed
+
+# ────────────────────── Константы ──────────────────────
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 в секунду в один чат.
+GLOBAL_RATE = 25          # сообщений/сек на всего бота (с запасом)
+GLOBAL_BURST = 25
+PER_CHAT_INTERVAL = 1.0   # сек между сообщениями в один чат
+MAX_WORKERS = 8
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0        # сек, удваивается с каждой попыткой
+BACKOFF_MAX = 30.0
+OUTBOX_MAX_ATTEMPTS = 5     # попыток (запусков рассылки) на одно сообщение из очереди
+OUTBOX_RETRY_BASE = 60.0    # сек до следующей попытки, удваивается
+OUTBOX_RETRY_MAX = 3600.0
+
+# ────────────────────── Ограничитель скорости ──────────────────────
+
+class TokenBucket:
+    """Потокобезопасный token bucket: rate токенов в секунду, не больше capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Глобальная пауза (после 429 с retry_after)."""
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+# ────────────────────── Отправка с повторами ──────────────────────
+
+def is_permanent(error: Exception) -> bool:
+    """Ошибка, которую повтор не исправит (4xx кроме 429, ошибки в коде)."""
+    if isinstance(error, ApiTelegramException):
+        return error.error_code != 429 and error.error_code < 500
+    return not isinstance(error, requests.exceptions.RequestException)
+
+
+def _retry_delay(error: Exception, attempt: int):
+    """
+    Сколько ждать перед повтором, или None, если повторять бессмысленно
+    (например, бот заблокирован пользователем).
+    """
+    if is_permanent(error):
+        return None
+    if isinstance(error, ApiTelegramException) and error.error_code == 429:
+        params = (error.result_json or {}).get('parameters') or {}
+        return float(params.get('retry_after', BACKOFF_BASE))
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+
+
+def _notify(on_result, key, error):
+    """Вызывает on_result; его ошибка (например, «database is locked») не прерывает рассылку."""
+    if not on_result:
+        return
+    try:
+        on_result(key, error)
+    except Exception as e:
+        print(f"⚠ Не удалось записать исход отправки {key}: {e}")
+
+
+def _send_chat(bot, chat_id, messages, bucket: TokenBucket, report: dict, lock: threading.Lock,
+               on_result=None):
+    """Отправляет все сообщения одного чата последовательно, с паузой между ними."""
+    last_sent = 0.0
+    for text, kwargs, key in messages:
+        for attempt in range(MAX_RETRIES + 1):
+            wait = last_sent + PER_CHAT_INTERVAL - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            bucket.acquire()
+            try:
+                bot.send_message(chat_id, text, **kwargs)
+                last_sent = time.monotonic()
+                with lock:
+                    report['sent'] += 1
+                _notify(on_result, key, None)
+                break
+            except Exception as e:
+                last_sent = time.monotonic()
+                delay = _retry_delay(e, attempt)
+                if delay is None or attempt == MAX_RETRIES:
+                    print(f"❌ Ошибка отправки для chat_id {chat_id}: {e}")
+                    with lock:
+                        report['failed'].append((chat_id, str(e)))
+                    _notify(on_result, key, e)
+                    break
+                if isinstance(e, ApiTelegramException) and e.error_code == 429:
+                    bucket.pause(delay)
+                with lock:
+                    report['retries'] += 1
+                time.sleep(delay)
+
+
+def dispatch(bot, messages: Iterable[Tuple], workers: int = MAX_WORKERS, on_result=None) -> dict:
+    """
+    Параллельная рассылка с учётом лимитов Telegram.
+    messages — итерируемое (chat_id, text[, kwargs для send_message[, key]]).
+    on_result(key, ошибка или None) вызывается после окончательного исхода каждого сообщения;
+    его исключения только логируются.
+    Возвращает отчёт: {'total', 'sent', 'failed': [(chat_id, ошибка)], 'retries', 'seconds'}.
+    """
+    by_chat = OrderedDict()
+    total = 0
+    for msg in messages:
+        chat_id, text = msg[0], msg[1]
+        kwargs = msg[2] if len(msg) > 2 else {}
+        key = msg[3] if len(msg) > 3 else None
+        by_chat.setdefault(chat_id, []).append((text, kwargs, key))
+        total += 1
+
+    report = {'total': total, 'sent': 0, 'failed': [], 'retries': 0, 'seconds': 0.0}
+    lock = threading.Lock()
+    bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='broadcast') as pool:
+        futures = [pool.submit(_send_chat, bot, cid, msgs, bucket, report, lock, on_result)
+                   for cid, msgs in by_chat.items()]
+        for f in futures:
+            f.result()
+
+    report['seconds'] = round(time.monotonic() - started, 2)
+    return report
+
+
+# ────────────────────── Очередь исходящих (outbox) ──────────────────────
+
+_drain_lock = threading.Lock()
+
+
+def drain_outbox(bot) -> dict:
+    """
+    Отправляет все готовые сообщения из очереди в БД и отмечает исход каждого.
+    Сообщения забираются порциями, пока готовые не кончатся, — отчёт охватывает
+    всю рассылку. Вызывается сразу после постановки рассылки и периодически
+    планировщиком, поэтому после перезапуска отправка продолжается с того же места.
+    """
+    with _drain_lock:
+        report = {'total': 0, 'sent': 0, 'failed': [], 'retries': 0, 'seconds': 0.0}
+        # повторы откладываются в будущее, а окончательные ошибки уходят в failed,
+        # поэтому каждая порция забирает только новые сообщения и цикл конечен
+        while True:
+            claimed = claim_outbox()
+            if not claimed:
+                return report
+            part = _drain_batch(bot, claimed)
+            for key in ('total', 'sent', 'failed', 'retries'):
+                report[key] += part[key]
+            report['seconds'] = round(report['seconds'] + part['seconds'], 2)
+
+
+def _drain_batch(bot, claimed) -> dict:
+    """Отправка одной порции из claim_outbox с записью исхода в БД."""
+    attempts = {outbox_id: n for outbox_id, _, _, _, n in claimed}
+
+    def on_result(outbox_id, error):
+        if error is None:
+            mark_outbox_sent(outbox_id)
+            return
+        n = attempts[outbox_id] + 1
+        if is_permanent(error) or n >= OUTBOX_MAX_ATTEMPTS:
+            mark_outbox_failed(outbox_id, str(error))
+        else:
+            retry_at = time.time() + min(OUTBOX_RETRY_MAX, OUTBOX_RETRY_BASE * 2 ** n)
+            mark_outbox_failed(outbox_id, str(error), retry_at)
+
+    messages = [(cid, text, kwargs, outbox_id) for outbox_id, cid, text, kwargs, _ in claimed]
+    return dispatch(bot, messages, on_result=on_result)
+
+
+def format_report(report: dict) -> str:
+    """Краткий текст итогов рассылки для администратора."""
+    text = (
+        f"📬 Отправлено: {report['sent']} из {report['total']}\n"
+        f"🔁 Повторов: {report['retries']}\n"
+        f"⏱ Время: {report['seconds']} с"
+    )
+    if report.get('duplicates'):
+        text += f"\n♻️ Уже отправлялись ранее: {report['duplicates']}"
+    if report['failed']:
+        text += f"\n❌ Не доставлено: {len(report['failed'])}"
+        for chat_id, error in report['failed'][:10]:
+            text += f"\n  • {chat_id}: {error[:80]}"
+    return text
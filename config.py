@@ -13,4 +13,15 @@ EXCEL_WEEKLY = 'weekly.xlsx'       # 📄 Еженедельный Excel-фай
 EXCEL_MONTHLY = 'monthly.xlsx'     # 📄 Ежемесячный Excel-файл
 BINDINGS_FILE = 'bindings.json'    # 👤 Привязки chat_id → телефон
 DB_FILE = 'weekly_results.db'      # 🗃️ Основная база данных SQLite
+ARCHIVE_DB_FILE = 'archive.db'     # 🗄️ Архив закрытых учебных лет
 TEMP_DIR = 'temp'                  # 📁 Каталог для временных PDF/файлов
+
+# ──────────────────────── Webhook (если WEBHOOK_URL не задан — long polling) ────────────────────────
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")             # 🌐 Публичный https-адрес бота
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")       # 🔑 Секрет заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+
+# ──────────────────────── Метрики ────────────────────────
+# В режиме webhook /metrics отдаёт сам webhook-сервер; при polling — отдельный порт (0 — выключено)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
@@ -1,24 +1,81 @@
+import json
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+import pandas as pd
+
 from config import DB_FILE
+from metrics import timed
 
 DB_PATH = DB_FILE
+BUSY_TIMEOUT_MS = 10000     # Сколько ждать снятия блокировки другим потоком
+CACHED_STATEMENTS = 256     # Размер кэша подготовленных запросов на соединение
+OUTBOX_LEASE = 15 * 60      # сек — сообщение в 'sending' дольше этого снова забирается
+
+_local = threading.local()
 
 # ──────────────────────── Подключение и инициализация ────────────────────────
 
 
 def get_connection():
-    conn = sqlite3.connect(DB_PATH)
+    """Новое соединение с WAL, synchronous=NORMAL и busy timeout."""
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000,
+                           cached_statements=CACHED_STATEMENTS)
     conn.row_factory = sqlite3.Row  # Для доступа к колонкам по имени
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
     return conn
 
 
-def init_db():
-    conn = get_connection()
-    cur = conn.cursor()
+@contextmanager
+def connection():
+    """
+    Соединение текущего потока (одно на поток и на файл БД).
+    Коммитит при выходе из самого внешнего блока, откатывает при ошибке.
+    """
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(DB_PATH)
+    if conn is None:
+        conn = conns[DB_PATH] = get_connection()
+
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield conn
+        if _local.depth == 1 and conn.in_transaction:
+            conn.commit()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        _local.depth -= 1
+
+
+def close_connection():
+    """Закрывает соединения текущего потока (для завершения рабочих потоков)."""
+    for conn in getattr(_local, 'conns', {}).values():
+        conn.close()
+    _local.conns = {}
+
 
-    # Таблица еженедельных результатов
-    cur.execute("""
+# ──────────────────────── Миграции схемы ────────────────────────
+# Версия схемы хранится в PRAGMA user_version. Каждая миграция — список
+# SQL-команд, выполняемых в одной транзакции. Команды, которые в транзакции
+# невозможны (VACUUM), оформляются как (OUTSIDE_TRANSACTION, [...]); повтор такой
+# миграции после сбоя должен быть безопасен. Новые миграции добавляются
+# только в конец списка.
+
+OUTSIDE_TRANSACTION = 'outside transaction'
+
+MIGRATIONS = [
+    # 1 — базовые таблицы
+    [
+        """
         CREATE TABLE IF NOT EXISTS weekly_results (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             student_name TEXT NOT NULL,
@@ -26,10 +83,8 @@ def init_db():
             mark TEXT,
             date TEXT NOT NULL
         )
-    """)
-
-    # Таблица ежемесячных результатов
-    cur.execute("""
+        """,
+        """
         CREATE TABLE IF NOT EXISTS results (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
@@ -37,154 +92,874 @@ def init_db():
             score TEXT,
             date TEXT NOT NULL
         )
-    """)
-
-    conn.commit()
-    conn.close()
-
+        """,
+    ],
+    # 2 — удаление дубликатов, уникальность и составные индексы (ученик, дата, предмет)
+    [
+        """
+        DELETE FROM weekly_results WHERE id NOT IN (
+            SELECT MIN(id) FROM weekly_results GROUP BY student_name, date, subject
+        )
+        """,
+        """
+        DELETE FROM results WHERE id NOT IN (
+            SELECT MIN(id) FROM results GROUP BY name, date, subject
+        )
+        """,
+        "DROP INDEX IF EXISTS ux_weekly_results",
+        "DROP INDEX IF EXISTS ux_results",
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_weekly_results_name_date_subject
+        ON weekly_results (student_name, date, subject)
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_results_name_date_subject
+        ON results (name, date, subject)
+        """,
+    ],
+    # 3 — очередь исходящих сообщений (outbox)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            chat_id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at REAL NOT NULL
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS ix_outbox_status_next
+        ON outbox (status, next_attempt_at)
+        """,
+    ],
+    # 4 — file_id уже загруженных в Telegram PDF-отчётов
+    [
+        """
+        CREATE TABLE IF NOT EXISTS pdf_file_ids (
+            cache_key TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """,
+    ],
+    # 5 — привязки chat_id → телефон (раньше bindings.json)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS bindings (
+            chat_id TEXT PRIMARY KEY,
+            phone TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_bindings_phone ON bindings (phone)",
+    ],
+    # 6 — снимки загруженных файлов: хэш строки каждого ученика на дату
+    [
+        """
+        CREATE TABLE IF NOT EXISTS upload_snapshots (
+            kind TEXT NOT NULL,
+            date TEXT NOT NULL,
+            student_name TEXT NOT NULL,
+            row_hash TEXT NOT NULL,
+            PRIMARY KEY (kind, date, student_name)
+        )
+        """,
+    ],
+    # 7 — готовые недельные сводки (текст /results и рассылки) по телефону родителя
+    [
+        """
+        CREATE TABLE IF NOT EXISTS weekly_snapshots (
+            phone TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            student_name TEXT NOT NULL,
+            results_text TEXT NOT NULL,
+            broadcast_text TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            source_key TEXT NOT NULL,
+            PRIMARY KEY (phone, position)
+        )
+        """,
+    ],
+    # 8 — индекс по дате для аналитики последних недель всего класса
+    [
+        "CREATE INDEX IF NOT EXISTS ix_weekly_results_date ON weekly_results (date)",
+    ],
+    # 9 — числовое хранение: справочник предметов, REAL вместо TEXT, единая шкала.
+    # Значения переводятся теми же функциями, что и при загрузке (to_pct, to_num — см. migrate):
+    # недельные оценки и «общий процент» — в проценты, месячные баллы — как есть,
+    # нечисловые значения становятся NULL.
+    [
+        "CREATE TABLE IF NOT EXISTS subjects (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+        """
+        INSERT OR IGNORE INTO subjects (name)
+        SELECT subject FROM weekly_results UNION SELECT subject FROM results ORDER BY 1
+        """,
+        """
+        CREATE TABLE weekly_results_v2 (
+            id INTEGER PRIMARY KEY,
+            student_name TEXT NOT NULL,
+            subject_id INTEGER NOT NULL REFERENCES subjects (id),
+            date TEXT NOT NULL,
+            mark REAL
+        )
+        """,
+        """
+        INSERT INTO weekly_results_v2 (id, student_name, subject_id, date, mark)
+        SELECT w.id, w.student_name, s.id, w.date, to_pct(w.mark)
+        FROM weekly_results w JOIN subjects s ON s.name = w.subject
+        """,
+        "DROP TABLE weekly_results",
+        "ALTER TABLE weekly_results_v2 RENAME TO weekly_results",
+        """
+        CREATE UNIQUE INDEX ux_weekly_results_name_date_subject
+        ON weekly_results (student_name, date, subject_id)
+        """,
+        "CREATE INDEX ix_weekly_results_date ON weekly_results (date)",
+        """
+        CREATE TABLE results_v2 (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            subject_id INTEGER NOT NULL REFERENCES subjects (id),
+            date TEXT NOT NULL,
+            score REAL
+        )
+        """,
+        """
+        INSERT INTO results_v2 (id, name, subject_id, date, score)
+        SELECT r.id, r.name, s.id, r.date,
+               CASE WHEN s.name = 'общий процент' THEN to_pct(r.score) ELSE to_num(r.score) END
+        FROM results r JOIN subjects s ON s.name = r.subject
+        """,
+        "DROP TABLE results",
+        "ALTER TABLE results_v2 RENAME TO results",
+        "CREATE UNIQUE INDEX ux_results_name_date_subject ON results (name, date, subject_id)",
+    ],
+    # 10 — помесячные сводки недельных оценок, ушедших в архив
+    [
+        """
+        CREATE TABLE IF NOT EXISTS weekly_monthly (
+            student_name TEXT NOT NULL,
+            month TEXT NOT NULL,
+            subject_id INTEGER NOT NULL REFERENCES subjects (id),
+            mark REAL,
+            weeks INTEGER NOT NULL,
+            PRIMARY KEY (student_name, month, subject_id)
+        ) WITHOUT ROWID
+        """,
+    ],
+    # 11 — исходное написание имени в снимке загрузки (для списка удалённых учеников)
+    [
+        "ALTER TABLE upload_snapshots ADD COLUMN display_name TEXT",
+    ],
+    # 12 — incremental auto_vacuum: режим включается только полной перестройкой файла,
+    # поэтому VACUUM делается один раз при запуске, а ночное обслуживание лишь
+    # возвращает свободные страницы (PRAGMA incremental_vacuum)
+    (OUTSIDE_TRANSACTION, [
+        "PRAGMA auto_vacuum = INCREMENTAL",
+        "VACUUM",
+    ]),
+]
+
+
+def migrate(conn) -> int:
+    """Доводит схему базы до последней версии. Возвращает итоговую версию."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    # миграции переводят старые значения по тем же правилам, что и запись новых
+    conn.create_function('to_num', 1, _to_number, deterministic=True)
+    conn.create_function('to_pct', 1, _to_percent, deterministic=True)
+
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        if isinstance(statements, tuple) and statements[0] == OUTSIDE_TRANSACTION:
+            if conn.in_transaction:
+                conn.commit()
+            for sql in statements[1]:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {number}")
+            print(f"🗃️ Схема БД обновлена до версии {number}")
+            continue
+        try:
+            conn.execute("BEGIN")
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"🗃️ Схема БД обновлена до версии {number}")
 
-# ──────────────────────── Сохранение данных ────────────────────────
+    return max(version, len(MIGRATIONS))
 
 
-def save_weekly_results(student_name, results: dict, date_str: str):
-    if not results:
-        return
+def init_db():
+    with connection() as conn:
+        migrate(conn)
 
-    conn = get_connection()
-    cur = conn.cursor()
-    student_name_clean = student_name.strip().lower()
 
-    for subject, mark in results.items():
-        subject_clean = subject.strip().lower()
+# ──────────────────────── Сохранение данных ────────────────────────
 
-        # Проверка на дубликат
-        cur.execute(
-            """
-            SELECT COUNT(*) FROM weekly_results
-            WHERE student_name = ? AND subject = ? AND date = ?
-        """, (student_name_clean, subject_clean, date_str))
-        exists = cur.fetchone()[0]
-
-        if exists:
-            print(
-                f"⚠️ Уже есть: {student_name_clean} — {subject_clean} — {date_str}"
-            )
+META_COLUMNS = ('Имя ученика', 'Телефон родителя')
+
+
+# Единая шкала хранения: недельные оценки и «общий процент» — проценты (0–100),
+# месячные баллы — как в ведомости. Нечисловые значения хранятся как NULL.
+PERCENT_SUBJECTS = {'общий процент'}
+
+
+def _to_number(value):
+    """Число из ячейки Excel или текста ('85%', '0,85'); None для пустых и нечисловых."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return None if value != value or value in (float('inf'), float('-inf')) else float(value)
+    try:
+        number = float(str(value).strip().rstrip('%').replace(',', '.'))
+    except ValueError:
+        return None
+    return number if number == number and abs(number) != float('inf') else None
+
+
+def _to_percent(value):
+    """Доли (≤ 1) переводятся в проценты, как transforms.to_percent, но без округления."""
+    number = _to_number(value)
+    if number is None:
+        return None
+    return round(number * 100, 6) if number <= 1 else number
+
+
+def _iter_result_rows(data, date_str):
+    """
+    Приводит входные данные к кортежам (имя, предмет, оценка, дата).
+    data — DataFrame в формате Excel ('Имя ученика' + колонки предметов)
+    или итерируемое (имя, предмет, оценка[, дата]).
+    """
+    if isinstance(data, pd.DataFrame):
+        if 'Имя ученика' not in data.columns:
+            return
+        subjects = [c for c in data.columns if c not in META_COLUMNS]
+        data = data.melt(id_vars=['Имя ученика'], value_vars=subjects,
+                         var_name='subject', value_name='mark').itertuples(index=False, name=None)
+
+    for row in data:
+        name, subject, mark = row[:3]
+        date = row[3] if len(row) > 3 else date_str
+        if not isinstance(name, str) or not name.strip() or not date:
             continue
-
-        # Вставка
-        cur.execute(
-            """
-            INSERT INTO weekly_results (student_name, subject, mark, date)
-            VALUES (?, ?, ?, ?)
-        """, (student_name_clean, subject_clean, mark, date_str))
-
-        print(f"✅ Добавлено: {student_name_clean} — {subject_clean} — {mark}")
-
-    conn.commit()
-    conn.close()
+        if hasattr(mark, 'item'):
+            mark = mark.item()  # numpy-скаляры → обычные python-типы
+        yield name.strip().lower(), str(subject).strip().lower(), mark, date
+
+
+def _subject_ids(conn, names) -> dict:
+    """
+    {предмет: id} из справочника subjects; недостающие предметы добавляются.
+    Без кэша между вызовами: id из откатившейся транзакции не должен пережить откат.
+    """
+    names = set(names)
+    conn.executemany("INSERT OR IGNORE INTO subjects (name) VALUES (?)", ((n,) for n in names))
+    return {name: subject_id for subject_id, name in conn.execute("SELECT id, name FROM subjects")
+            if name in names}
+
+
+@timed
+def get_subject_ids(names) -> dict:
+    """{предмет: id}; предметы приводятся к нижнему регистру, новые добавляются в справочник."""
+    with connection() as conn:
+        return _subject_ids(conn, (str(n).strip().lower() for n in names))
+
+
+def _bulk_insert(sql, rows) -> dict:
+    """Вставка всех строк одной транзакцией; дубликаты отсекает UNIQUE-индекс."""
+    rows = list(rows)
+    if not rows:
+        return {'inserted': 0, 'skipped': 0}
+
+    with connection() as conn:
+        before = conn.total_changes
+        conn.executemany(sql, rows)
+        inserted = conn.total_changes - before
+    return {'inserted': inserted, 'skipped': len(rows) - inserted}
+
+
+def _bulk_insert_results(sql, rows, kind: str) -> dict:
+    """
+    _bulk_insert для таблиц результатов: предметы заменяются на id из справочника,
+    значения приводятся к шкале хранения — в той же транзакции.
+    """
+    rows = list(rows)
+    with connection() as conn:
+        ids = _subject_ids(conn, (subject for _, subject, _, _ in rows)) if rows else {}
+        return _bulk_insert(sql, (
+            (name, ids[subject],
+             _to_percent(value) if kind == 'weekly' or subject in PERCENT_SUBJECTS else _to_number(value),
+             date)
+            for name, subject, value, date in rows))
+
+
+@timed
+def bulk_save_weekly_results(data, date_str: str = None) -> dict:
+    """Массовое сохранение еженедельных результатов. Возвращает {'inserted', 'skipped'}."""
+    return _bulk_insert_results("""
+        INSERT OR IGNORE INTO weekly_results (student_name, subject_id, mark, date)
+        VALUES (?, ?, ?, ?)
+    """, _iter_result_rows(data, date_str), 'weekly')
+
+
+@timed
+def bulk_save_monthly_results(data, date_str: str = None) -> dict:
+    """Массовое сохранение ежемесячных результатов. Возвращает {'inserted', 'skipped'}."""
+    return _bulk_insert_results("""
+        INSERT OR IGNORE INTO results (name, subject_id, score, date)
+        VALUES (?, ?, ?, ?)
+    """, _iter_result_rows(data, date_str), 'monthly')
+
+
+@timed
+def bulk_upsert_weekly_results(data, date_str: str = None) -> dict:
+    """
+    Как bulk_save_weekly_results, но исправленная оценка перезаписывает старую.
+    'inserted' — новые или изменённые строки, 'skipped' — совпавшие с БД.
+    """
+    return _bulk_insert_results("""
+        INSERT INTO weekly_results (student_name, subject_id, mark, date)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (student_name, date, subject_id) DO UPDATE SET mark = excluded.mark
+        WHERE weekly_results.mark IS NOT excluded.mark
+    """, _iter_result_rows(data, date_str), 'weekly')
+
+
+@timed
+def bulk_upsert_monthly_results(data, date_str: str = None) -> dict:
+    """Ежемесячный аналог bulk_upsert_weekly_results."""
+    return _bulk_insert_results("""
+        INSERT INTO results (name, subject_id, score, date)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (name, date, subject_id) DO UPDATE SET score = excluded.score
+        WHERE results.score IS NOT excluded.score
+    """, _iter_result_rows(data, date_str), 'monthly')
+
+
+# тип отчёта → (таблица, колонка имени, колонка значения)
+RESULT_TABLES = {
+    'weekly': ('weekly_results', 'student_name', 'mark'),
+    'monthly': ('results', 'name', 'score'),
+}
+
+
+@timed
+def delete_student_results(kind: str, student_name: str, date_str: str, keep_subjects=None) -> int:
+    """
+    Удаляет результаты ученика за дату, кроме предметов из keep_subjects.
+    Возвращает число удалённых строк.
+    """
+    table, name_col, _ = RESULT_TABLES[kind]
+    sql = f"DELETE FROM {table} WHERE {name_col} = ? AND date = ?"
+    params = [student_name.strip().lower(), date_str]
+    keep = [str(s).strip().lower() for s in keep_subjects or ()]
+    if keep:
+        sql += (f" AND subject_id NOT IN"
+                f" (SELECT id FROM subjects WHERE name IN ({', '.join('?' * len(keep))}))")
+        params += keep
+    with connection() as conn:
+        return conn.execute(sql, params).rowcount
+
+
+@timed
+def get_upload_snapshot(kind: str, date_str: str) -> dict:
+    """
+    {имя в нижнем регистре: (хэш строки, имя как в файле)} из последней загрузки
+    файла этого типа за дату.
+    """
+    with connection() as conn:
+        return {name: (row_hash, display_name) for name, row_hash, display_name in conn.execute("""
+            SELECT student_name, row_hash, COALESCE(display_name, student_name)
+            FROM upload_snapshots WHERE kind = ? AND date = ?
+        """, (kind, date_str))}
+
+
+@timed
+def replace_upload_snapshot(kind: str, date_str: str, rows: dict):
+    """Заменяет снимок загрузки (kind, дата) на {имя: (хэш, имя как в файле)}."""
+    with connection() as conn:
+        conn.execute("DELETE FROM upload_snapshots WHERE kind = ? AND date = ?", (kind, date_str))
+        conn.executemany("""
+            INSERT INTO upload_snapshots (kind, date, student_name, row_hash, display_name)
+            VALUES (?, ?, ?, ?, ?)
+        """, ((kind, date_str, name, row_hash, display_name)
+              for name, (row_hash, display_name) in rows.items()))
+
+
+@timed
+def save_weekly_results(student_name, results: dict, date_str: str):
+    if not results:
+        return {'inserted': 0, 'skipped': 0}
+    return bulk_save_weekly_results(
+        ((student_name, subject, mark) for subject, mark in results.items()), date_str)
 
 
+@timed
 def save_monthly_results(student_name, results: dict, date_str: str):
     if not results:
-        return
-
-    conn = get_connection()
-    cur = conn.cursor()
-    name_clean = student_name.strip().lower()
-
-    for subject, mark in results.items():
-        subject_clean = subject.strip().lower()
-
-        cur.execute(
-            """
-            SELECT COUNT(*) FROM results
-            WHERE name = ? AND subject = ? AND date = ?
-        """, (name_clean, subject_clean, date_str))
-        exists = cur.fetchone()[0]
-
-        if exists:
-            print(
-                f"⚠️ Уже есть (MONTHLY): {name_clean} — {subject_clean} — {date_str}"
-            )
-            continue
-
-        cur.execute(
-            """
-            INSERT INTO results (name, subject, score, date)
-            VALUES (?, ?, ?, ?)
-        """, (name_clean, subject_clean, mark, date_str))
-
-        print(
-            f"✅ Добавлено (MONTHLY): {name_clean} — {subject_clean} — {mark}")
-
-    conn.commit()
-    conn.close()
+        return {'inserted': 0, 'skipped': 0}
+    return bulk_save_monthly_results(
+        ((student_name, subject, mark) for subject, mark in results.items()), date_str)
 
 
 # ──────────────────────── Получение данных ────────────────────────
 
 
+@timed
 def get_last_weekly_results(student_name):
     """Результаты за последнюю (самую свежую) неделю"""
-    conn = get_connection()
-    cur = conn.cursor()
     name_clean = student_name.strip().lower()
-
-    # Получаем последнюю дату
-    cur.execute(
-        """
-        SELECT MAX(date) AS last_date FROM weekly_results
-        WHERE student_name = ?
-    """, (name_clean, ))
-    row = cur.fetchone()
-
-    if not row or not row['last_date']:
-        conn.close()
-        return []
-
-    last_date = row['last_date']
-
-    # Получаем все предметы по этой дате
-    cur.execute(
-        """
-        SELECT subject, mark, date FROM weekly_results
-        WHERE student_name = ? AND date = ?
-        ORDER BY subject ASC
-    """, (name_clean, last_date))
-    rows = cur.fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT s.name AS subject, w.mark, w.date
+            FROM weekly_results w JOIN subjects s ON s.id = w.subject_id
+            WHERE w.student_name = ? AND w.date = (
+                SELECT MAX(date) FROM weekly_results WHERE student_name = ?
+            )
+            ORDER BY s.name ASC
+        """, (name_clean, name_clean)).fetchall()
     return [(r['subject'], r['mark'], r['date']) for r in rows]
 
 
+@timed
 def get_all_weekly_results(student_name):
     """Все еженедельные результаты ученика"""
-    conn = get_connection()
-    cur = conn.cursor()
     name_clean = student_name.strip().lower()
-    cur.execute(
-        """
-        SELECT subject, mark, date FROM weekly_results
-        WHERE student_name = ?
-        ORDER BY date ASC
-    """, (name_clean, ))
-    rows = cur.fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT s.name AS subject, w.mark, w.date
+            FROM weekly_results w JOIN subjects s ON s.id = w.subject_id
+            WHERE w.student_name = ?
+            ORDER BY w.date ASC
+        """, (name_clean, )).fetchall()
     return [(r['subject'], r['mark'], r['date']) for r in rows]
 
 
+@timed
 def get_all_monthly_results(student_name):
     """Все ежемесячные результаты ученика"""
-    conn = get_connection()
-    cur = conn.cursor()
     name_clean = student_name.strip().lower()
-    cur.execute(
-        """
-        SELECT subject, score, date FROM results
-        WHERE name = ?
-        ORDER BY date ASC
-    """, (name_clean, ))
-    rows = cur.fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT s.name AS subject, r.score, r.date
+            FROM results r JOIN subjects s ON s.id = r.subject_id
+            WHERE r.name = ?
+            ORDER BY r.date ASC
+        """, (name_clean, )).fetchall()
     return [(r['subject'], r['score'], r['date']) for r in rows]
 
 
+def _iter_history_rows(conn, names=None, report_types=('weekly', 'monthly')):
+    """Один запрос по обеим таблицам; строки отсортированы по (имя, тип, дата)."""
+    parts, params = [], []
+    name_filter = ""
+    if names is not None:
+        name_filter = f" IN ({', '.join('?' * len(names))})"
+
+    if 'weekly' in report_types:
+        parts.append("SELECT 'weekly' AS kind, w.student_name AS name, s.name AS subject, "
+                     "w.mark AS value, w.date "
+                     "FROM weekly_results w JOIN subjects s ON s.id = w.subject_id"
+                     + (" WHERE w.student_name" + name_filter if names is not None else ""))
+        params.extend(names or [])
+    if 'monthly' in report_types:
+        parts.append("SELECT 'monthly' AS kind, r.name, s.name AS subject, r.score AS value, r.date "
+                     "FROM results r JOIN subjects s ON s.id = r.subject_id"
+                     + (" WHERE r.name" + name_filter if names is not None else ""))
+        params.extend(names or [])
+    if not parts:
+        return iter(())
+
+    return conn.execute(" UNION ALL ".join(parts) + " ORDER BY name, kind, date", params)
+
+
+@timed
+def get_histories(names=None, report_types=('weekly', 'monthly')) -> dict:
+    """
+    История учеников одним запросом, уже сгруппированная по датам:
+    {имя в нижнем регистре: {'weekly': [{'date', 'subjects'}], 'monthly': [...]}}.
+    Значения — числа в шкале хранения (см. PERCENT_SUBJECTS) или None.
+    names=None — все ученики (для пакетных отчётов).
+    """
+    if names is not None:
+        names = sorted({str(n).strip().lower() for n in names})
+        if not names:
+            return {}
+
+    histories = {}
+    with connection() as conn:
+        current = None
+        for r in _iter_history_rows(conn, names, report_types):
+            key = (r['name'], r['kind'])
+            if key != current:
+                current = key
+                records = histories.setdefault(r['name'], {}).setdefault(r['kind'], [])
+                last = None
+            if r['date'] != last:
+                last = r['date']
+                records.append({'date': last, 'subjects': {}})
+            records[-1]['subjects'][r['subject']] = r['value']
+    return histories
+
+
+# ──────────────────────── Аналитика ────────────────────────
+
+
+@timed
+def get_latest_weekly_date():
+    """Дата последней недели с результатами (по индексу) или None."""
+    with connection() as conn:
+        return conn.execute("SELECT MAX(date) FROM weekly_results").fetchone()[0]
+
+
+def iso_week(date_str: str) -> str:
+    """Учебная неделя даты 'YYYY-MM-DD' как 'YYYY-Www' (ISO, сортируется как строка)."""
+    year, week, _ = datetime.strptime(date_str, "%Y-%m-%d").isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+@timed
+def get_recent_weekly_scores(weeks: int = 4) -> list:
+    """
+    Числовые оценки всех учеников за последние weeks календарных недель, в процентах:
+    [(date, name, subject, value)]. За неделю бывает несколько дат (загрузка файла
+    и сохранение при рассылке), поэтому граница ищется по неделям, а не по датам.
+    Даты отбираются по индексу ix_weekly_results_date.
+    """
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None  # простые кортежи: на 200 тыс. строк вдвое быстрее sqlite3.Row
+        # не больше 7 дат на неделю — последних weeks * 7 дат заведомо хватает
+        dates = cursor.execute(
+            "SELECT DISTINCT date FROM weekly_results ORDER BY date DESC LIMIT ?", (weeks * 7,)).fetchall()
+        seen, start = set(), None
+        for (day,) in dates:
+            week = iso_week(day)
+            if week not in seen:
+                if len(seen) == weeks:
+                    break
+                seen.add(week)
+            start = day
+        if start is None:
+            return []
+        return cursor.execute("""
+            SELECT w.date, w.student_name, s.name, w.mark
+            FROM weekly_results w JOIN subjects s ON s.id = w.subject_id
+            WHERE w.date >= ? AND w.mark IS NOT NULL
+        """, (start,)).fetchall()
+
+
+# ──────────────────────── Готовые недельные сводки ────────────────────────
+
+
+@timed
+def replace_weekly_snapshots(source_key: str, snapshots: dict):
+    """
+    Заменяет все сводки. snapshots — {телефон: [{'name', 'text', 'broadcast',
+    'values', 'labels', 'valid'}]}; source_key — версия weekly.xlsx, из которой они построены.
+    """
+    rows = [
+        (phone, position, s['name'], s['text'], s['broadcast'],
+         json.dumps({'values': s['values'], 'labels': s['labels'], 'valid': s['valid']}, ensure_ascii=False),
+         source_key)
+        for phone, items in snapshots.items() for position, s in enumerate(items)
+    ]
+    with connection() as conn:
+        conn.execute("DELETE FROM weekly_snapshots")
+        conn.executemany("""
+            INSERT INTO weekly_snapshots
+                (phone, position, student_name, results_text, broadcast_text, payload, source_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+
+@timed
+def load_weekly_snapshots():
+    """(source_key, {телефон: [сводка]}) или (None, {}), если сводок нет."""
+    source_key, snapshots = None, {}
+    with connection() as conn:
+        for r in conn.execute("SELECT * FROM weekly_snapshots ORDER BY phone, position"):
+            source_key = r['source_key']
+            payload = json.loads(r['payload'])
+            snapshots.setdefault(r['phone'], []).append({
+                'name': r['student_name'], 'phone': r['phone'], 'text': r['results_text'],
+                'broadcast': r['broadcast_text'], **payload,
+            })
+    return source_key, snapshots
+
+
+# ──────────────────────── Привязки chat_id → телефон ────────────────────────
+
+
+@timed
+def get_all_bindings() -> dict:
+    with connection() as conn:
+        rows = conn.execute("SELECT chat_id, phone FROM bindings").fetchall()
+    return {r['chat_id']: r['phone'] for r in rows}
+
+
+@timed
+def upsert_bindings(bindings) -> int:
+    """Атомарная вставка/обновление привязок. bindings — итерируемое (chat_id, phone)."""
+    now = time.time()
+    rows = [(str(chat_id), phone, now) for chat_id, phone in bindings]
+    with connection() as conn:
+        conn.executemany("""
+            INSERT INTO bindings (chat_id, phone, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET phone = excluded.phone, updated_at = excluded.updated_at
+        """, rows)
+    return len(rows)
+
+
+@timed
+def get_chat_ids_by_phone(phone: str) -> list:
+    with connection() as conn:
+        rows = conn.execute("SELECT chat_id FROM bindings WHERE phone = ?", (phone,)).fetchall()
+    return [r['chat_id'] for r in rows]
+
+
+# ──────────────────────── Очередь исходящих сообщений ────────────────────────
+# Статусы: pending → sending → sent | failed. Ключ идемпотентности не даёт
+# поставить одно и то же сообщение дважды (например, при повторном /broadcast).
+
+
+@timed
+def enqueue_outbox(messages) -> dict:
+    """
+    Ставит сообщения в очередь одной транзакцией.
+    messages — итерируемое (idempotency_key, chat_id, text, kwargs для send_message).
+    Возвращает {'inserted', 'skipped'}.
+    """
+    now = time.time()
+    rows = [
+        (key, str(chat_id), json.dumps({'text': text, 'kwargs': kwargs or {}}, ensure_ascii=False), now, now)
+        for key, chat_id, text, kwargs in messages
+    ]
+    return _bulk_insert("""
+        INSERT OR IGNORE INTO outbox (idempotency_key, chat_id, payload, next_attempt_at, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, rows)
+
+
+@timed
+def claim_outbox(limit: int = 1000, lease: float = OUTBOX_LEASE) -> list:
+    """
+    Забирает готовые к отправке сообщения (status='pending', срок наступил)
+    и помечает их 'sending' на lease секунд. Сообщения, застрявшие в 'sending'
+    дольше (исход не записался в БД), забираются снова — доставка «хотя бы раз».
+    Возвращает [(id, chat_id, text, kwargs, attempts)].
+    """
+    now = time.time()
+    with connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute("""
+            SELECT id, chat_id, payload, attempts FROM outbox
+            WHERE status IN ('pending', 'sending') AND next_attempt_at <= ?
+            ORDER BY id
+            LIMIT ?
+        """, (now, limit)).fetchall()
+        conn.executemany("UPDATE outbox SET status = 'sending', next_attempt_at = ? WHERE id = ?",
+                         [(now + lease, r['id']) for r in rows])
+
+    claimed = []
+    for r in rows:
+        payload = json.loads(r['payload'])
+        claimed.append((r['id'], r['chat_id'], payload['text'], payload['kwargs'], r['attempts']))
+    return claimed
+
+
+@timed
+def mark_outbox_sent(outbox_id: int):
+    with connection() as conn:
+        conn.execute("""
+            UPDATE outbox SET status = 'sent', attempts = attempts + 1, last_error = NULL
+            WHERE id = ?
+        """, (outbox_id,))
+
+
+@timed
+def mark_outbox_failed(outbox_id: int, error: str, retry_at: float = None):
+    """Неудачная попытка: при retry_at — вернуть в очередь, иначе — окончательно failed."""
+    with connection() as conn:
+        conn.execute("""
+            UPDATE outbox
+            SET status = ?, attempts = attempts + 1, last_error = ?, next_attempt_at = COALESCE(?, next_attempt_at)
+            WHERE id = ?
+        """, ('pending' if retry_at else 'failed', error, retry_at, outbox_id))
+
+
+@timed
+def reset_stuck_outbox() -> int:
+    """После перезапуска: сообщения, зависшие в 'sending', возвращаются в очередь."""
+    with connection() as conn:
+        cur = conn.execute("UPDATE outbox SET status = 'pending', next_attempt_at = ? WHERE status = 'sending'",
+                           (time.time(),))
+        return cur.rowcount
+
+
+@timed
+def get_outbox_stats() -> dict:
+    with connection() as conn:
+        rows = conn.execute("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status").fetchall()
+    return {r['status']: r['n'] for r in rows}
+
+
+# ──────────────────────── file_id загруженных PDF ────────────────────────
+
+
+@timed
+def get_pdf_file_id(cache_key: str):
+    with connection() as conn:
+        row = conn.execute("SELECT file_id FROM pdf_file_ids WHERE cache_key = ?", (cache_key,)).fetchone()
+    return row['file_id'] if row else None
+
+
+@timed
+def save_pdf_file_id(cache_key: str, file_id: str):
+    with connection() as conn:
+        conn.execute("""
+            INSERT INTO pdf_file_ids (cache_key, file_id, created_at) VALUES (?, ?, ?)
+            ON CONFLICT(cache_key) DO UPDATE SET file_id = excluded.file_id, created_at = excluded.created_at
+        """, (cache_key, file_id, time.time()))
+
+
+@timed
+def forget_pdf_file_id(cache_key: str):
+    with connection() as conn:
+        conn.execute("DELETE FROM pdf_file_ids WHERE cache_key = ?", (cache_key,))
+
+
+# ──────────────────────── Обслуживание: архив, очистка, сжатие ────────────────────────
+# Архив — отдельный файл SQLite с той же числовой схемой, но WITHOUT ROWID:
+# строка хранится прямо в первичном ключе, без отдельного UNIQUE-индекса.
+
+ARCHIVE_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS archive.subjects (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+    """
+    CREATE TABLE IF NOT EXISTS archive.weekly_results (
+        student_name TEXT NOT NULL,
+        date TEXT NOT NULL,
+        subject_id INTEGER NOT NULL,
+        mark REAL,
+        PRIMARY KEY (student_name, date, subject_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS archive.results (
+        name TEXT NOT NULL,
+        date TEXT NOT NULL,
+        subject_id INTEGER NOT NULL,
+        score REAL,
+        PRIMARY KEY (name, date, subject_id)
+    ) WITHOUT ROWID
+    """,
+)
+
+
+@timed
+def archive_results(before: str, archive_path: str) -> dict:
+    """
+    Переносит результаты с датой раньше before в архивную БД, а недельные оценки
+    перед удалением сворачивает в помесячные средние (weekly_monthly).
+    Отчёты, /trend и get_histories читают только основные таблицы: перенесённая
+    история из них пропадает и остаётся лишь в архиве и сводке weekly_monthly.
+    Повторный запуск безопасен: в архив строки добавляются через INSERT OR IGNORE,
+    а сводка и удаление из основной БД идут одной транзакцией.
+    Возвращает {'weekly', 'monthly', 'summarized'} — число перенесённых и сводных строк.
+    """
+    conn = get_connection()  # отдельное соединение: ATTACH не должен остаться у потока пула
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        for sql in ARCHIVE_SCHEMA:
+            conn.execute(sql)
+        with conn:
+            before_changes = conn.total_changes
+            conn.execute("""
+                INSERT INTO weekly_monthly (student_name, month, subject_id, mark, weeks)
+                SELECT student_name, substr(date, 1, 7), subject_id, AVG(mark), COUNT(mark)
+                FROM weekly_results WHERE date < ?
+                GROUP BY student_name, substr(date, 1, 7), subject_id
+                ON CONFLICT (student_name, month, subject_id) DO UPDATE SET
+                    mark = (COALESCE(mark * weeks, 0) + COALESCE(excluded.mark * excluded.weeks, 0))
+                           / NULLIF(weeks + excluded.weeks, 0),
+                    weeks = weeks + excluded.weeks
+            """, (before,))
+            summarized = conn.total_changes - before_changes
+            conn.execute("INSERT OR IGNORE INTO archive.subjects (id, name) SELECT id, name FROM main.subjects")
+            conn.execute("""
+                INSERT OR IGNORE INTO archive.weekly_results (student_name, date, subject_id, mark)
+                SELECT student_name, date, subject_id, mark FROM main.weekly_results WHERE date < ?
+            """, (before,))
+            conn.execute("""
+                INSERT OR IGNORE INTO archive.results (name, date, subject_id, score)
+                SELECT name, date, subject_id, score FROM main.results WHERE date < ?
+            """, (before,))
+            weekly = conn.execute("DELETE FROM main.weekly_results WHERE date < ?", (before,)).rowcount
+            monthly = conn.execute("DELETE FROM main.results WHERE date < ?", (before,)).rowcount
+        conn.execute("DETACH DATABASE archive")
+    finally:
+        conn.close()
+
+    if weekly or monthly:
+        # в архив пишут редко и большими порциями — после записи уплотняем страницы
+        archive = sqlite3.connect(archive_path, timeout=BUSY_TIMEOUT_MS / 1000)
+        try:
+            archive.execute("VACUUM")
+        finally:
+            archive.close()
+    return {'weekly': weekly, 'monthly': monthly, 'summarized': summarized}
+
+
+@timed
+def prune_service_rows(snapshots_before: str, outbox_before: float, pdf_ids_before: float) -> dict:
+    """
+    Удаляет служебные строки, которые больше не нужны: снимки старых загрузок,
+    доставленные или окончательно не доставленные сообщения, давние file_id PDF.
+    """
+    with connection() as conn:
+        return {
+            'snapshots': conn.execute(
+                "DELETE FROM upload_snapshots WHERE date < ?", (snapshots_before,)).rowcount,
+            'outbox': conn.execute(
+                "DELETE FROM outbox WHERE status IN ('sent', 'failed') AND created_at < ?",
+                (outbox_before,)).rowcount,
+            'pdf_ids': conn.execute(
+                "DELETE FROM pdf_file_ids WHERE created_at < ?", (pdf_ids_before,)).rowcount,
+        }
+
+
+@timed
+def compact_database() -> dict:
+    """
+    Возвращает свободные страницы файлу (incremental vacuum), обновляет статистику
+    планировщика запросов и усекает WAL. Полного VACUUM здесь нет: он держал бы
+    блокировку дольше busy timeout — режим auto_vacuum включает миграция 12.
+    Возвращает {'bytes_before', 'bytes_after'}.
+    """
+    conn = get_connection()
+    conn.isolation_level = None  # VACUUM и PRAGMA вне транзакции
+    try:
+        def size():
+            return (conn.execute("PRAGMA page_count").fetchone()[0]
+                    * conn.execute("PRAGMA page_size").fetchone()[0])
+
+        bytes_before = size()
+        # executescript доводит PRAGMA до конца; execute освободил бы одну страницу
+        conn.executescript("PRAGMA incremental_vacuum;")
+        conn.execute("PRAGMA analysis_limit = 1000")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        return {'bytes_before': bytes_before, 'bytes_after': size()}
+    finally:
+        conn.close()
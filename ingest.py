@@ -0,0 +1,148 @@
+import hashlib
+import json
+from typing import Iterator
+
+from db import (connection, bulk_upsert_weekly_results, bulk_upsert_monthly_results,
+                delete_student_results, get_upload_snapshot, replace_upload_snapshot, META_COLUMNS)
+from utils import iter_weekly_sheet, iter_monthly_sheet, MONTHLY_COLUMNS
+from metrics import timed
+
+# ──────────────────────── Константы ────────────────────────
+BATCH_SIZE = 2000   # строк (ученик, предмет) на один executemany
+PROGRESS_EVERY = 200  # учеников между вызовами progress
+
+# ──────────────────────── Разбор строк ────────────────────────
+
+def _valid_name(name) -> bool:
+    return isinstance(name, str) and bool(name.strip())
+
+
+def _weekly_records(path: str, invalid: list) -> Iterator[tuple]:
+    """(имя, {предмет: оценка}) для каждой строки ученика."""
+    for n, record in enumerate(iter_weekly_sheet(path), start=2):
+        name = record.get('Имя ученика')
+        if not _valid_name(name):
+            if any(v is not None for v in record.values()):
+                invalid.append(f"строка {n}")
+            continue
+        yield name, {subject: mark for subject, mark in record.items() if subject not in META_COLUMNS}
+
+
+def _monthly_records(path: str, invalid: list) -> Iterator[tuple]:
+    """
+    (имя, {предмет: балл}); для строки с нечисловым баллом — (имя, None):
+    такая строка не пишется, но и не считается удалённой.
+    """
+    subjects = [col for col in MONTHLY_COLUMNS if col != 'Имя ученика']
+    for record in iter_monthly_sheet(path):
+        name = str(record['Имя ученика']).strip()
+        try:
+            values = [None if record[col] is None else float(record[col]) for col in subjects]
+        except (TypeError, ValueError) as e:
+            print(f"⚠ Ошибка в месячных данных для {name}: {e}")
+            invalid.append(name)
+            yield name, None
+            continue
+        yield name, dict(zip(subjects, values))
+
+
+def row_hash(values: dict) -> str:
+    """Хэш строки ученика: не зависит от порядка колонок и регистра названий предметов."""
+    normalized = {str(subject).strip().lower(): value for subject, value in values.items()}
+    payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+# ──────────────────────── Загрузка в БД ────────────────────────
+
+@timed('excel.ingest')
+def ingest_workbook(path: str, kind: str, date_str: str, batch_size: int = BATCH_SIZE,
+                    progress=None) -> dict:
+    """
+    Инкрементально переносит Excel-файл в БД. Каждая строка ученика хэшируется
+    и сравнивается со снимком предыдущей загрузки за ту же дату: совпавшие строки
+    пропускаются, новые и изменённые пишутся UPSERT'ом (исправленная оценка
+    заменяет старую), ученики, исчезнувшие из файла, удаляются.
+    Файл сначала целиком разбирается без транзакции, затем изменения пишутся одной
+    короткой транзакцией — разбор и вызовы progress не держат блокировку записи.
+    kind — 'weekly' или 'monthly'.
+    Возвращает {'added', 'changed', 'removed': [имена], 'unchanged': int,
+    'written': строк записано, 'invalid': [имена/строки с ошибками]}.
+    progress(обработано учеников) вызывается каждые PROGRESS_EVERY учеников;
+    исключение из него (например, отмена задачи) прерывает загрузку до записи в БД.
+    Файл без единой строки ученика или без единого ученика прошлой загрузки за ту же
+    дату отклоняется (ValueError) — так не стираются данные при загрузке не того файла.
+    """
+    invalid = []
+    if kind == 'weekly':
+        records, writer = _weekly_records(path, invalid), bulk_upsert_weekly_results
+    else:
+        records, writer = _monthly_records(path, invalid), bulk_upsert_monthly_results
+
+    diff = {'added': [], 'changed': [], 'removed': [], 'unchanged': 0, 'written': 0, 'invalid': invalid}
+
+    # ── разбор: только чтение, без транзакции ──
+    snapshot = get_upload_snapshot(kind, date_str)  # имя → (хэш, имя как в файле)
+    hashes = {}
+    changed = []  # (ключ, оценки) изменённых учеников: их старые предметы удаляются
+    pending = []  # (ключ, предмет, значение) для UPSERT
+    for n, (name, values) in enumerate(records, start=1):
+        if progress and n % PROGRESS_EVERY == 0:
+            progress(n)
+        name = name.strip()
+        key = name.lower()
+        if key in hashes:
+            # раньше INSERT OR IGNORE тоже оставлял первую строку
+            invalid.append(f"повтор: {name}")
+            continue
+        if values is None:
+            if key in snapshot:
+                hashes[key] = snapshot[key]
+            continue
+
+        current = row_hash(values)
+        hashes[key] = (current, name)
+        previous = snapshot[key][0] if key in snapshot else None
+        if previous == current:
+            diff['unchanged'] += 1
+            continue
+        if previous is None:
+            diff['added'].append(name)
+        else:
+            diff['changed'].append(name)
+            changed.append((key, values))
+        pending.extend((key, subject, value) for subject, value in values.items())
+
+    if not hashes:
+        raise ValueError("в файле нет ни одной строки ученика — проверьте, тот ли это файл")
+    if snapshot and not snapshot.keys() & hashes.keys():
+        raise ValueError("в файле нет ни одного ученика из прошлой загрузки за эту дату — "
+                         "проверьте, тот ли это файл")
+    removed = snapshot.keys() - hashes.keys()
+
+    # ── запись: одна короткая транзакция, ошибка откатывает её целиком ──
+    with connection():  # загрузки и обслуживание идут под одной блокировкой — снимок не устарел
+        for key, values in changed:
+            delete_student_results(kind, key, date_str, keep_subjects=values)
+        for i in range(0, len(pending), batch_size):
+            diff['written'] += writer(pending[i:i + batch_size], date_str)['inserted']
+        for key in removed:
+            delete_student_results(kind, key, date_str)
+            diff['removed'].append(snapshot[key][1])
+        replace_upload_snapshot(kind, date_str, hashes)
+    return diff
+
+
+def format_diff(diff: dict, limit: int = 10) -> str:
+    """Краткий текст изменений для администратора."""
+    text = f"🗃️ База обновлена, записано строк: {diff['written']}"
+    for icon, label, names in (('➕', 'Новых', diff['added']),
+                               ('✏️', 'Изменено', diff['changed']),
+                               ('➖', 'Удалено', diff['removed'])):
+        if names:
+            text += f"\n{icon} {label}: {len(names)}"
+            shown = ', '.join(str(n) for n in names[:limit])
+            text += f" ({shown}{', …' if len(names) > limit else ''})"
+    text += f"\n♻️ Без изменений: {diff['unchanged']}"
+    if diff['invalid']:
+        text += f"\n⚠️ Пропущено строк с ошибками: {len(diff['invalid'])}"
+    return text
@@ -0,0 +1,152 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot.apihelper import ApiTelegramException
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+# ──────────────────────── Константы ────────────────────────
+JOB_WORKERS = 2            # одновременных фоновых задач
+PROGRESS_INTERVAL = 2.0    # сек между правками статусного сообщения
+KEEP_FINISHED = 50         # сколько завершённых задач помнить для /jobs
+
+STATUS_ICONS = {
+    'queued': '🕓',
+    'running': '⏳',
+    'done': '✅',
+    'failed': '❌',
+    'cancelled': '🚫',
+}
+
+# ──────────────────────── Задача ────────────────────────
+
+class JobCancelled(Exception):
+    """Задача отменена администратором."""
+
+
+class Job:
+    """Фоновая задача: статус, текст прогресса и флаг отмены."""
+
+    def __init__(self, job_id: int, title: str, chat_id):
+        self.id = job_id
+        self.title = title
+        self.chat_id = chat_id
+        self.message_id = None
+        self.status = 'queued'
+        self.progress = ''
+        self.result = None
+        self._cancel = threading.Event()
+        self._reported = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self.status in ('queued', 'running')
+
+    def cancel(self):
+        self._cancel.set()
+
+    def check(self):
+        """Вызывается из кода задачи в безопасных точках; прерывает её после отмены."""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def text(self) -> str:
+        text = f"{STATUS_ICONS[self.status]} Задача #{self.id}: {self.title}"
+        if self.progress:
+            text += f"\n{self.progress}"
+        return text
+
+# ──────────────────────── Очередь ────────────────────────
+
+class JobQueue:
+    """
+    Пул фоновых задач для долгой работы админа (загрузка и разбор Excel),
+    чтобы обработчики Telegram не ждали её и продолжали отвечать родителям.
+    Прогресс пишется правками одного статусного сообщения с кнопкой «Отменить».
+    """
+
+    def __init__(self, bot, workers: int = JOB_WORKERS):
+        self.bot = bot
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def submit(self, title: str, chat_id, fn, *args) -> Job:
+        """
+        Ставит fn(job, *args) в очередь. fn сообщает прогресс через report(job, текст),
+        проверяет отмену через job.check() и возвращает итоговый текст.
+        """
+        job = Job(next(self._ids), title, chat_id)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._forget_finished()
+        try:
+            sent = self.bot.send_message(chat_id, job.text(), reply_markup=self._markup(job))
+            job.message_id = sent.message_id
+        except Exception as e:
+            print(f"⚠ Не удалось отправить статус задачи #{job.id}: {e}")
+        self.pool.submit(self._run, job, fn, args)
+        return job
+
+    def _run(self, job: Job, fn, args):
+        try:
+            job.check()
+            job.status = 'running'
+            self._edit(job)
+            job.result = fn(job, *args)
+            job.status = 'done'
+            job.progress = job.result or ''
+        except JobCancelled:
+            job.status = 'cancelled'
+            job.progress = "Отменено, изменения не сохранены."
+        except Exception as e:
+            print(f"❌ Задача #{job.id} ({job.title}): {e}")
+            job.status = 'failed'
+            job.progress = f"Ошибка: {e}"
+        self._edit(job)
+
+    def report(self, job: Job, progress: str, force: bool = False):
+        """Обновляет прогресс; правка сообщения — не чаще раза в PROGRESS_INTERVAL."""
+        job.check()
+        job.progress = progress
+        now = time.monotonic()
+        if force or now - job._reported >= PROGRESS_INTERVAL:
+            job._reported = now
+            self._edit(job)
+
+    def cancel(self, job_id: int) -> bool:
+        job = self.jobs.get(job_id)
+        if not job or not job.active:
+            return False
+        job.cancel()
+        return True
+
+    def active(self) -> list:
+        with self.lock:
+            return [job for job in self.jobs.values() if job.active]
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[:-KEEP_FINISHED]:
+            del self.jobs[job_id]
+
+    def _markup(self, job: Job):
+        if not job.active:
+            return None
+        markup = InlineKeyboardMarkup()
+        markup.add(InlineKeyboardButton("✖️ Отменить", callback_data=f"cancel_job:{job.id}"))
+        return markup
+
+    def _edit(self, job: Job):
+        if job.message_id is None:
+            return
+        try:
+            self.bot.edit_message_text(job.text(), job.chat_id, job.message_id,
+                                       reply_markup=self._markup(job))
+        except ApiTelegramException as e:
+            if 'message is not modified' not in str(e):
+                print(f"⚠ Не удалось обновить статус задачи #{job.id}: {e}")
+        except Exception as e:
+            print(f"⚠ Не удалось обновить статус задачи #{job.id}: {e}")
@@ -1,62 +1,130 @@
+import asyncio
 import os
+import threading
 from datetime import datetime
-import pandas as pd
+import requests
 import telebot
-from telebot import types
-from apscheduler.schedulers.background import BackgroundScheduler
-
-from config import BOT_TOKEN, ADMIN_ID, EXCEL_WEEKLY, EXCEL_MONTHLY
+from telebot import types, asyncio_filters
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_handler_backends import State, StatesGroup
+from telebot.asyncio_helper import ApiTelegramException
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from config import (
+    BOT_TOKEN, ADMIN_ID, EXCEL_WEEKLY, EXCEL_MONTHLY, TEMP_DIR,
+    WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, METRICS_PORT
+)
 from background import keep_alive
 from utils import (
-    load_bindings, save_bindings,
-    get_student_data, format_results,
-    load_monthly_data, find_chat_id_by_name
+    import_bindings_json, load_bindings, get_binding, save_binding,
+    get_student_data, get_weekly_snapshots, build_weekly_snapshots, get_roster, invalidate_roster,
+    load_monthly_data, normalize_name, find_chat_ids_by_name, get_name_conflicts
 )
 from db import (
-    init_db, save_weekly_results,
-    save_monthly_results, get_all_weekly_results, get_all_monthly_results
+    init_db, reset_stuck_outbox, enqueue_outbox, bulk_save_weekly_results,
+    get_pdf_file_id, save_pdf_file_id, forget_pdf_file_id, get_histories
+)
+from ingest import ingest_workbook, format_diff
+from transforms import monthly_texts
+import analytics
+from maintenance import run_maintenance, format_maintenance
+from report import (
+    preload_fonts, progress_filename, pdf_cache_key,
+    get_cached_progress_pdf, generate_class_reports
 )
-from report import generate_progress_pdf
+from broadcast import drain_outbox, format_report
+from jobs import JobQueue
+from runtime import run_io, run_cpu, shutdown
+from webhook import run_webhook
+from metrics import instrument_bot, format_stats, start_metrics_server
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-bot = telebot.TeleBot(BOT_TOKEN)
-init_db()
-os.makedirs('temp', exist_ok=True)
+# Обработчики работают на асинхронном боте; рассылки и фоновые задачи идут
+# в пулах потоков и пользуются синхронным клиентом API (без polling).
+bot = AsyncTeleBot(BOT_TOKEN)
+bot.add_custom_filter(asyncio_filters.StateFilter(bot))
+api = None   # синхронный клиент и очередь задач создаёт startup()
+jobs = None
+
+
+def startup():
+    """
+    Всё, что трогает БД, файлы и сеть, — только при запуске бота, а не при импорте:
+    процессы отчётов класса (spawn) заново импортируют этот модуль как __mp_main__.
+    """
+    global api, jobs
+    api = telebot.TeleBot(BOT_TOKEN, threaded=False)
+    jobs = JobQueue(api)
+    init_db()
+    import_bindings_json()
+    reset_stuck_outbox()
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    try:
+        preload_fonts()
+    except FileNotFoundError as e:
+        print(e)
+
+
+class RegisterStates(StatesGroup):
+    phone = State()
 
 # ───────────────────────────── Еженедельная рассылка ─────────────────────────────
 
 def weekly_broadcast():
     bindings = load_bindings()
-    count = 0
+    messages = []
     date_str = datetime.now().strftime("%Y-%m-%d")
+    to_save = []
 
     for cid, phone in bindings.items():
-        _, rows = get_student_data(phone)
-        if rows is None or rows.empty:
+        summaries = get_weekly_snapshots(phone)
+        if not summaries:
             print(f"📭 Нет данных для chat_id {cid} ({phone})")
             continue
 
-        for _, row in rows.iterrows():
-            name = row['Имя ученика']
-            try:
-                results = row.drop(['Имя ученика', 'Телефон родителя'], errors='ignore').astype(float).to_dict()
-            except Exception as e:
-                print(f"⚠️ Ошибка в данных ученика {name}: {e}")
+        for summary in summaries:
+            name = summary['name']
+            if not summary['valid']:
+                print(f"⚠️ Ошибка в данных ученика {name}: есть нечисловые оценки")
                 continue
 
-            results_percent = {k: round(v * 100) for k, v in results.items()}
-            save_weekly_results(name, results, date_str)
+            to_save.extend((name, subject, mark) for subject, mark in summary['values'].items())
+            key = f"weekly:{cid}:{name.strip().lower()}:{date_str}"
+            messages.append((key, cid, summary['broadcast'], {'parse_mode': 'Markdown'}))
+
+    stats = bulk_save_weekly_results(to_save, date_str)
+    print(f"🗃️ Сохранено: {stats['inserted']}, уже было: {stats['skipped']}")
+    if stats['inserted']:
+        analytics.invalidate()
+
+    queued = enqueue_outbox(messages)
+    report = drain_outbox(api)
+    report['duplicates'] = queued['skipped']
+    print(f"✅ Рассылка: {report['sent']}/{report['total']}, ошибок: {len(report['failed'])}")
+    return report
+
+
+def monthly_broadcast():
+    """Месячный отчёт всем родителям. Возвращает (отчёт рассылки, пропущенные имена)."""
+    monthly_df = load_monthly_data()
+    # Одно имя у разных родителей — не угадываем, кому отправлять
+    ambiguous = {name for name, phones in get_name_conflicts().items() if len(phones) > 1}
+    skipped = []
+    messages = []
+    date_str = datetime.now().strftime("%Y-%m-%d")
 
-            text_lines = [f"🧪 {subject.strip()}: {score}%" for subject, score in results_percent.items()]
-            text = f"📅 Итоги недели для *{name}*:\n\n" + "\n".join(text_lines)
+    for name, text in monthly_texts(monthly_df):
+        if normalize_name(name) in ambiguous:
+            skipped.append(name)
+            continue
+        for cid in find_chat_ids_by_name(name):
+            key = f"monthly:{cid}:{normalize_name(name)}:{date_str}"
+            messages.append((key, cid, text, {'parse_mode': 'Markdown'}))
 
-            try:
-                bot.send_message(cid, text, parse_mode='Markdown')
-                print(f"✅ Отправлено {name} → {cid}")
-                count += 1
-            except Exception as e:
-                print(f"❌ Ошибка отправки для chat_id {cid}: {e}")
-    return count
+    queued = enqueue_outbox(messages)
+    report = drain_outbox(api)
+    report['duplicates'] = queued['skipped']
+    return report, skipped
 
 
 # ───────────────────────────── Команды ─────────────────────────────
@@ -64,262 +132,279 @@ def weekly_broadcast():
 
 # Команда /start
 @bot.message_handler(commands=['start'])
-def handle_start(message):
+async def handle_start(message):
     markup = InlineKeyboardMarkup()
     markup.add(InlineKeyboardButton("📝 Зарегистрироваться", callback_data='register'))
     markup.add(InlineKeyboardButton("📊 Результаты недели", callback_data='results'))
     markup.add(InlineKeyboardButton("📈 Прогресс ", callback_data='progress'))
+    markup.add(InlineKeyboardButton("📉 Динамика", callback_data='trend'))
 
     text = (
         "👋 Добро пожаловать!\n\n"
         "Я помогу вам получать результаты вашего ребёнка.\n\n"
         "👇 Выберите действие:"
     )
-    bot.send_message(message.chat.id, text, reply_markup=markup)
+    await bot.send_message(message.chat.id, text, reply_markup=markup)
 
 # Обработка нажатий кнопок
 @bot.callback_query_handler(func=lambda call: True)
-def handle_callback(call):
+async def handle_callback(call):
     chat_id = call.message.chat.id
     if call.data == 'register':
-        msg = bot.send_message(chat_id, "📱 Введите новый номер телефона (9 цифр):")
-        bot.register_next_step_handler(msg, register_phone)
+        await ask_phone(call.from_user.id, chat_id)
     elif call.data == 'results':
-        handle_results(call.message)
+        await handle_results(call.message)
     elif call.data == 'progress':
-        handle_progress(call.message)
+        await handle_progress(call.message)
+    elif call.data == 'trend':
+        await handle_trend(call.message)
+    elif call.data.startswith('cancel_job:'):
+        if call.from_user.id != ADMIN_ID:
+            await bot.answer_callback_query(call.id, "⛔ Только админ может.")
+            return
+        job_id = int(call.data.split(':', 1)[1])
+        cancelled = jobs.cancel(job_id)
+        await bot.answer_callback_query(call.id, "🚫 Отменяю..." if cancelled else "Задача уже завершена.")
 
 # Команда /register (если кто-то всё же введёт вручную)
 @bot.message_handler(commands=['register'])
-def handle_register(message):
-    chat_id = message.chat.id
-    msg = bot.send_message(chat_id, "📱 Введите новый номер телефона (9 цифр):")
-    bot.register_next_step_handler(msg, register_phone)
+async def handle_register(message):
+    await ask_phone(message.from_user.id, message.chat.id)
+
+
+async def ask_phone(user_id, chat_id):
+    """Следующее сообщение пользователя в этом чате будет разобрано как номер телефона."""
+    await bot.set_state(user_id, RegisterStates.phone, chat_id)
+    await bot.send_message(chat_id, "📱 Введите новый номер телефона (9 цифр):")
 
 
 # Обработка номера
-def register_phone(message):
-    phone = message.text.strip()
+@bot.message_handler(state=RegisterStates.phone)
+async def register_phone(message):
+    await bot.delete_state(message.from_user.id, message.chat.id)
+    phone = (message.text or '').strip()
     chat_id = str(message.chat.id)
 
     if not phone.isdigit() or len(phone) != 9:
-        bot.send_message(chat_id, "❗️ Неверный номер. Введите ровно 9 цифр. Начните заново с /register.")
+        await bot.send_message(chat_id, "❗️ Неверный номер. Введите ровно 9 цифр. Начните заново с /register.")
         return
 
-    bindings = load_bindings()
-    bindings[chat_id] = phone
-    save_bindings(bindings)
-    bot.send_message(chat_id, "✅ Вы успешно зарегистрированы!")
+    await run_io(save_binding, chat_id, phone)
+    await bot.send_message(chat_id, "✅ Вы успешно зарегистрированы!")
 
 
 @bot.message_handler(commands=['results'])
-def handle_results(message):
+async def handle_results(message):
     chat_id = str(message.chat.id)
-    bindings = load_bindings()
-    if chat_id not in bindings:
-        bot.send_message(chat_id, "❗️ Сначала зарегистрируйтесь: /register")
+    phone = await run_io(get_binding, chat_id)
+    if not phone:
+        await bot.send_message(chat_id, "❗️ Сначала зарегистрируйтесь: /register")
         return
-    phone = bindings[chat_id]
-    _, rows = get_student_data(phone)
-    if rows is None or rows.empty:
-        bot.send_message(chat_id, "😞 Нет данных.")
+    summaries = await run_io(get_weekly_snapshots, phone)
+    if not summaries:
+        await bot.send_message(chat_id, "😞 Нет данных.")
+        return
+    for summary in summaries:
+        await bot.send_message(chat_id, summary['text'], parse_mode='Markdown')
+
+
+def load_trends(phone):
+    """[(имя, дата, показатели)] по детям родителя из кэша аналитики."""
+    trends = []
+    for summary in get_weekly_snapshots(phone):
+        date, subjects = analytics.get_student_trend(summary['name'])
+        trends.append((summary['name'], date, subjects))
+    return trends
+
+
+@bot.message_handler(commands=['trend'])
+async def handle_trend(message):
+    chat_id = str(message.chat.id)
+    phone = await run_io(get_binding, chat_id)
+    if not phone:
+        await bot.send_message(chat_id, "❗️ Сначала зарегистрируйтесь: /register")
         return
-    for _, row in rows.iterrows():
-        text = format_results(row['Имя ученика'], row)
-        bot.send_message(chat_id, text, parse_mode='Markdown')
+    trends = await run_io(load_trends, phone)
+    if not trends:
+        await bot.send_message(chat_id, "😞 Нет данных.")
+        return
+    for name, date, subjects in trends:
+        await bot.send_message(chat_id, analytics.format_trend(name, date, subjects), parse_mode='Markdown')
+
+
+@bot.message_handler(commands=['class_summary'])
+async def handle_class_summary(message):
+    if message.from_user.id != ADMIN_ID:
+        await bot.reply_to(message, "⛔ Только админ может.")
+        return
+    summary = await run_io(analytics.get_class_analytics)
+    await bot.reply_to(message, analytics.format_class_summary(summary), parse_mode='Markdown')
 
 
 @bot.message_handler(commands=['broadcast'])
-def handle_broadcast(message):
+async def handle_broadcast(message):
     if message.from_user.id != ADMIN_ID:
-        bot.reply_to(message, "⛔ Только админ может.")
+        await bot.reply_to(message, "⛔ Только админ может.")
         return
-    count = weekly_broadcast()
-    bot.reply_to(message, f"✅ Рассылка завершена. Отправлено: {count}")
+    report = await run_io(weekly_broadcast)
+    await bot.reply_to(message, "✅ Рассылка завершена.\n" + format_report(report))
 
 
 @bot.message_handler(commands=['monthly_report'])
-def handle_monthly_report(message):
+async def handle_monthly_report(message):
     if message.from_user.id != ADMIN_ID:
-        bot.reply_to(message, "⛔ Только админ может.")
+        await bot.reply_to(message, "⛔ Только админ может.")
         return
     try:
-        monthly_df = load_monthly_data()
-        student_df = pd.read_excel(EXCEL_WEEKLY, dtype={'Телефон родителя': str})
-        student_df['Имя ученика'] = student_df['Имя ученика'].str.strip()
-        student_df['Телефон родителя'] = student_df['Телефон родителя'].str.strip()
-        bindings = load_bindings()
-        sent = 0
-
-        for _, row in monthly_df.iterrows():
-            name = str(row['Имя ученика']).strip()
-            cid = find_chat_id_by_name(name, bindings, student_df)
-            if not cid:
-                continue
-            text = (
-                f"📅 *Месячный отчёт для {name}*:\n\n"
-                f"📚 Таджикский язык: {row['Таджикский язык']} из 75\n"
-                f"🌱 Биология: {row['Биология']} из 150\n"
-                f"🧪 Химия: {row['Химия']} из 175\n"
-                f"⚡️ Физика: {row['Физика']} из 100\n"
-                f"📊 Общий балл: {row['Общий балл']} из 500\n"
-                f"✅ Процент: {row['Общий процент']}%"
-            )
-            results_dict = {
-                'таджикский язык': row['Таджикский язык'],
-                'биология': row['Биология'],
-                'химия': row['Химия'],
-                'физика': row['Физика'],
-                'общий балл': row['Общий балл'],  
-                'общий процент': row['Общий процент'],
-            }
-            #save_monthly_results(name, results_dict, datetime.now().strftime("%Y-%m-%d"))
-            bot.send_message(cid, text, parse_mode='Markdown')
-            sent += 1
-
-        bot.reply_to(message, f"✅ Месячный отчёт отправлен: {sent}")
+        report, skipped = await run_io(monthly_broadcast)
+        text = "✅ Месячный отчёт отправлен.\n" + format_report(report)
+        if skipped:
+            text += "\n⚠️ Одинаковые имена у разных родителей, не отправлено: " + ", ".join(sorted(set(skipped)))
+        await bot.reply_to(message, text)
     except Exception as e:
-        bot.reply_to(message, f"⚠️ Ошибка: {e}")
+        await bot.reply_to(message, f"⚠️ Ошибка: {e}")
 
 
 @bot.message_handler(commands=['progress'])
-def handle_progress(message):
+async def handle_progress(message):
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
     markup.add("📄 Недельный прогресс", "📄 Месячный прогресс", "📄 Оба файла")
-    bot.send_message(message.chat.id, "📊 Какой отчёт хотите получить?", reply_markup=markup)
+    await bot.send_message(message.chat.id, "📊 Какой отчёт хотите получить?", reply_markup=markup)
 
 
 @bot.message_handler(func=lambda m: m.text in ["📄 Недельный прогресс", "📄 Месячный прогресс", "📄 Оба файла"])
-def handle_progress_choice(message):
+async def handle_progress_choice(message):
     if message.text == "📄 Недельный прогресс":
-        handle_progress_weekly(message)
+        await handle_progress_weekly(message)
     elif message.text == "📄 Месячный прогресс":
-        handle_progress_monthly(message)
+        await handle_progress_monthly(message)
     elif message.text == "📄 Оба файла":
-        handle_progress_combined(message)
+        await handle_progress_combined(message)
 
 
-def handle_progress_weekly(message):
-    chat_id = str(message.chat.id)
-    bindings = load_bindings()
-    if chat_id not in bindings:
-        bot.send_message(chat_id, "❗ Сначала зарегистрируйтесь: /register")
-        return
-
-    phone = bindings[chat_id]
+async def send_progress_pdf(chat_id, name, structured, report_type, caption):
+    """
+    Отправляет PDF-отчёт. Если такой же отчёт уже загружался в Telegram,
+    повторно отправляется его file_id — без рендера и без загрузки файла.
+    """
+    key = pdf_cache_key(name, structured, report_type)
+    file_id = await run_io(get_pdf_file_id, key)
+    if file_id:
+        try:
+            await bot.send_document(chat_id, file_id, caption=caption)
+            return
+        except ApiTelegramException:
+            await run_io(forget_pdf_file_id, key)
+
+    pdf, _ = await run_cpu(get_cached_progress_pdf, name, structured, report_type=report_type)
+    # байты уходят в multipart-запрос напрямую, без временного файла
+    sent = await bot.send_document(chat_id, pdf, caption=caption,
+                                   visible_file_name=progress_filename(name, report_type))
+    if sent and sent.document:
+        await run_io(save_pdf_file_id, key, sent.document.file_id)
+
+
+PROGRESS_TEXTS = {
+    'weekly': ("📄 Еженедельный прогресс", "📭 Нет еженедельных данных для"),
+    'monthly': ("📄 Ежемесячный прогресс", "📭 Нет ежемесячных данных для"),
+}
+
+
+def load_progress(chat_id, report_types):
+    """(имена детей, истории) для родителя; None — не зарегистрирован, [] — нет данных."""
+    phone = get_binding(chat_id)
+    if not phone:
+        return None, {}
     _, rows = get_student_data(phone)
     if rows is None or rows.empty:
-        bot.send_message(chat_id, "😞 Данных не найдено.")
-        return
-
-    for _, row in rows.iterrows():
-        name = row['Имя ученика']
-        records = get_all_weekly_results(name)
-        if not records:
-            bot.send_message(chat_id, f"📭 Нет еженедельных данных для {name}.")
-            continue
-
-        data = {}
-        for subj, mark, date in records:
-            data.setdefault(date, {})[subj] = mark
-
-        structured = [{'date': d, 'subjects': s} for d, s in sorted(data.items())]
-        try:
-            pdf_path = generate_progress_pdf(name, structured, report_type="weekly")
-            with open(pdf_path, 'rb') as f:
-                bot.send_document(chat_id, f, caption=f"📄 Еженедельный прогресс для {name}")
-        except Exception as e:
-            bot.send_message(chat_id, f"⚠ Ошибка PDF: {e}")
+        return [], {}
+    names = [str(n) for n in rows['Имя ученика']]
+    return names, get_histories(names, report_types)
 
 
-def handle_progress_monthly(message):
+async def send_progress(message, report_types):
+    """PDF-прогресс по всем детям родителя: одно обращение к БД на все отчёты."""
     chat_id = str(message.chat.id)
-    bindings = load_bindings()
-    if chat_id not in bindings:
-        bot.send_message(chat_id, "❗ Сначала зарегистрируйтесь: /register")
+    names, histories = await run_io(load_progress, chat_id, report_types)
+    if names is None:
+        await bot.send_message(chat_id, "❗ Сначала зарегистрируйтесь: /register")
         return
-
-    phone = bindings[chat_id]
-    _, rows = get_student_data(phone)
-    if rows is None or rows.empty:
-        bot.send_message(chat_id, "😞 Данных не найдено.")
+    if not names:
+        await bot.send_message(chat_id, "😞 Данных не найдено.")
         return
 
-    for _, row in rows.iterrows():
-        name = row['Имя ученика']
-        records = get_all_monthly_results(name)
-        if not records:
-            bot.send_message(chat_id, f"📭 Нет ежемесячных данных для {name}.")
-            continue
+    for name in names:
+        history = histories.get(name.strip().lower(), {})
+        found = False
+        for report_type in report_types:
+            structured = history.get(report_type)
+            if not structured:
+                continue
+            found = True
+            caption, _ = PROGRESS_TEXTS[report_type]
+            try:
+                await send_progress_pdf(chat_id, name, structured, report_type, f"{caption} для {name}")
+            except Exception as e:
+                await bot.send_message(chat_id, f"⚠ Ошибка PDF ({report_type}): {e}")
 
-        data = {}
-        for subj, score, date in records:
-            data.setdefault(date, {})[subj] = score
+        if not found:
+            no_data = PROGRESS_TEXTS[report_types[0]][1] if len(report_types) == 1 else "📭 Нет данных для"
+            await bot.send_message(chat_id, f"{no_data} {name}.")
 
-        structured = [{'date': d, 'subjects': s} for d, s in sorted(data.items())]
-        try:
-            pdf_path = generate_progress_pdf(name, structured, report_type="monthly")
-            with open(pdf_path, 'rb') as f:
-                bot.send_document(chat_id, f, caption=f"📄 Ежемесячный прогресс для {name}")
-        except Exception as e:
-            bot.send_message(chat_id, f"⚠ Ошибка PDF: {e}")
 
+async def handle_progress_weekly(message):
+    await send_progress(message, ('weekly',))
 
-def handle_progress_combined(message):
-    chat_id = str(message.chat.id)
-    bindings = load_bindings()
-    if chat_id not in bindings:
-        bot.send_message(chat_id, "❗ Сначала зарегистрируйтесь: /register")
-        return
 
-    phone = bindings[chat_id]
-    _, rows = get_student_data(phone)
-    if rows is None or rows.empty:
-        bot.send_message(chat_id, "😞 Данных не найдено.")
-        return
+async def handle_progress_monthly(message):
+    await send_progress(message, ('monthly',))
 
-    for _, row in rows.iterrows():
-        name = row['Имя ученика']
-        has_data = False
 
-        weekly = get_all_weekly_results(name)
-        if weekly:
-            weekly_data = {}
-            for subj, mark, date in weekly:
-                weekly_data.setdefault(date, {})[subj] = mark
-            structured_weekly = [{'date': d, 'subjects': s} for d, s in sorted(weekly_data.items())]
-            try:
-                path = generate_progress_pdf(name + "_weekly", structured_weekly, report_type="weekly")
-                with open(path, 'rb') as f:
-                    bot.send_document(chat_id, f, caption=f"📄 Еженедельный прогресс: {name}")
-                has_data = True
-            except Exception as e:
-                bot.send_message(chat_id, f"⚠ PDF ошибка (weekly): {e}")
-
-        monthly = get_all_monthly_results(name)
-        if monthly:
-            monthly_data = {}
-            for subj, score, date in monthly:
-                monthly_data.setdefault(date, {})[subj] = score
-            structured_monthly = [{'date': d, 'subjects': s} for d, s in sorted(monthly_data.items())]
-            try:
-                path = generate_progress_pdf(name + "_monthly", structured_monthly, report_type="monthly")
-                with open(path, 'rb') as f:
-                    bot.send_document(chat_id, f, caption=f"📄 Ежемесячный прогресс: {name}")
-                has_data = True
-            except Exception as e:
-                bot.send_message(chat_id, f"⚠ PDF ошибка (monthly): {e}")
+async def handle_progress_combined(message):
+    await send_progress(message, ('weekly', 'monthly'))
 
-        if not has_data:
-            bot.send_message(chat_id, f"📭 Нет данных для {name}.")
 
+def class_histories():
+    """Истории всех учеников; имена в БД хранятся в нижнем регистре — для PDF берём написание из Excel."""
+    histories = get_histories()
+    roster = get_roster()
+    display = {}
+    if roster is not None and 'Имя ученика' in roster.columns:
+        display = {str(n).strip().lower(): str(n).strip() for n in roster['Имя ученика'].dropna()}
+    return {display.get(name, name.title()): h for name, h in histories.items()}
 
 
+@bot.message_handler(commands=['class_reports'])
+async def handle_class_reports(message):
+    """Админ: PDF-отчёты (недельный и месячный) для всего класса одним ZIP."""
+    if message.from_user.id != ADMIN_ID:
+        await bot.reply_to(message, "⛔ Только админ может.")
+        return
+    try:
+        histories = await run_io(class_histories)
+        if not histories:
+            await bot.reply_to(message, "📭 В базе нет результатов.")
+            return
+
+        await bot.reply_to(message, f"⏳ Генерирую отчёты для {len(histories)} учеников...")
+        stamp = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+        out_dir = os.path.join(TEMP_DIR, f"class_reports_{stamp}")
+        # внутри свой пул процессов; поток io только ждёт его
+        result = await run_io(generate_class_reports, histories, out_dir, zip_path=f"{out_dir}.zip")
+
+        with open(result['zip'], 'rb') as f:
+            await bot.send_document(message.chat.id, f,
+                                    caption=f"📦 Отчёты класса: {len(result['files'])} PDF")
+        if result['errors']:
+            await bot.reply_to(message, "⚠️ Ошибки:\n" + "\n".join(f"{n}: {e}" for n, e in result['errors'][:20]))
+    except Exception as e:
+        await bot.reply_to(message, f"⚠️ Ошибка: {e}")
+
 
 @bot.message_handler(content_types=['document'])
-def handle_file_upload(message):
+async def handle_file_upload(message):
     if message.from_user.id != ADMIN_ID:
-        bot.reply_to(message, "⛔ Только админ может загружать файлы.")
+        await bot.reply_to(message, "⛔ Только админ может загружать файлы.")
         return
 
     file_name = message.document.file_name.lower()
@@ -330,63 +415,125 @@ def handle_file_upload(message):
         path = EXCEL_MONTHLY
         label = 'ежемесячный'
     else:
-        bot.reply_to(message, "⚠️ Имя файла должно содержать 'week'/'неделя' или 'month'/'месяц'/'итог'.")
+        await bot.reply_to(message, "⚠️ Имя файла должно содержать 'week'/'неделя' или 'month'/'месяц'/'итог'.")
         return
 
+    # Скачивание и разбор идут в фоне — обработчики продолжают отвечать родителям
+    await run_io(jobs.submit, f"загрузка файла «{message.document.file_name}»", message.chat.id,
+                 upload_job, message.document.file_id, path, label)
+
+
+_ingest_lock = threading.Lock()  # одна запись в БД за раз, скачивания — параллельно
+
+
+def upload_job(job, file_id, path, label):
+    """
+    Фоновая загрузка Excel: скачивание во временный файл, разбор в БД и только
+    после успеха — подмена рабочего файла. При отмене или ошибке всё остаётся как было.
+    """
+    tmp_path = os.path.join(TEMP_DIR, f"upload_{job.id}.xlsx")
     try:
-        file_info = bot.get_file(message.document.file_id)
-        downloaded = bot.download_file(file_info.file_path)
-        with open(path, 'wb') as f:
-            f.write(downloaded)
-        bot.reply_to(message, f"✅ Файл сохранён как *{label}* (`{path}`).", parse_mode='Markdown')
-
-        if label == 'еженедельный':
-            df = pd.read_excel(path, dtype=str)
-            date_str = datetime.now().strftime("%Y-%m-%d")
-            for _, row in df.iterrows():
-                name = row.get('Имя ученика')
-                if not name:
-                    continue
-                results = row.drop(labels=['Имя ученика', 'Телефон родителя'], errors='ignore').to_dict()
-                save_weekly_results(name, results, date_str)
-        elif label == 'ежемесячный':
-            from utils import load_monthly_data
-
-            df = load_monthly_data(path)
-
-            date_str = datetime.now().strftime("%Y-%m-%d")
-            for _, row in df.iterrows():
-                name = row.get('Имя ученика')
-                if not name:
-                    continue
-                try:
-                    results_dict = {
-                        'таджикский язык': float(row.get('Таджикский язык', 0)),
-                        'биология': float(row.get('Биология', 0)),
-                        'химия': float(row.get('Химия', 0)),
-                        'физика': float(row.get('Физика', 0)),
-                        'общий балл': float(row.get('Общий балл', 0)),
-                        'общий процент': float(row.get('Общий процент', 0)),
-                    }
-                    save_monthly_results(name, results_dict, date_str)
-                except Exception as e:
-                    print(f"⚠ Ошибка при сохранении месячных данных для {name}: {e}")
+        def on_download(done, total):
+            size = f"{done // 1024} из {total // 1024} КБ" if total else f"{done // 1024} КБ"
+            jobs.report(job, f"📥 Скачивание: {size}")
+
+        download_document(file_id, tmp_path, on_download)
+
+        kind = 'weekly' if label == 'еженедельный' else 'monthly'
+        jobs.report(job, "🕓 Ожидание записи в базу...", force=True)
+        with _ingest_lock:
+            jobs.report(job, "🗃️ Разбор файла...", force=True)
+            diff = ingest_workbook(tmp_path, kind, datetime.now().strftime("%Y-%m-%d"),
+                                   progress=lambda n: jobs.report(job, f"🗃️ Обработано учеников: {n}"))
+            os.replace(tmp_path, path)
+        if path == EXCEL_WEEKLY:
+            invalidate_roster()
+            build_weekly_snapshots()
+            analytics.invalidate()
+            analytics.get_class_analytics()  # прогрев: первый /trend не ждёт расчёта
+        return f"Файл сохранён как {label} ({path}).\n" + format_diff(diff)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def download_document(file_id, dest, progress=None):
+    """
+    Скачивает файл из Telegram потоком на диск (без буфера в памяти) и атомарно подменяет dest.
+    progress(скачано байт, всего байт или 0) вызывается после каждого блока.
+    """
+    file_info = api.get_file(file_id)
+    url = (telebot.apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(
+        BOT_TOKEN, file_info.file_path)
+    tmp_path = dest + '.part'
+    try:
+        with requests.get(url, stream=True, timeout=60, proxies=telebot.apihelper.proxy) as r:
+            r.raise_for_status()
+            total = int(r.headers.get('Content-Length') or 0)
+            done = 0
+            with open(tmp_path, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+                    done += len(chunk)
+                    if progress:
+                        progress(done, total)
+        os.replace(tmp_path, dest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@bot.message_handler(commands=['jobs'])
+async def handle_jobs(message):
+    if message.from_user.id != ADMIN_ID:
+        await bot.reply_to(message, "⛔ Только админ может.")
+        return
+    active = jobs.active()
+    if not active:
+        await bot.reply_to(message, "💤 Нет активных задач.")
+        return
+    await bot.reply_to(message, "\n\n".join(job.text() for job in active) + "\n\nОтмена: /cancel <номер>")
 
 
-    except Exception as e:
-        bot.reply_to(message, f"❌ Ошибка при загрузке: {e}")
+@bot.message_handler(commands=['cancel'])
+async def handle_cancel(message):
+    if message.from_user.id != ADMIN_ID:
+        await bot.reply_to(message, "⛔ Только админ может.")
+        return
+    parts = message.text.split()
+    if len(parts) < 2 or not parts[1].lstrip('#').isdigit():
+        await bot.reply_to(message, "❗ Укажите номер задачи: /cancel 3")
+        return
+    job_id = int(parts[1].lstrip('#'))
+    if jobs.cancel(job_id):
+        await bot.reply_to(message, f"🚫 Задача #{job_id} будет отменена.")
+    else:
+        await bot.reply_to(message, f"❗ Задача #{job_id} не найдена или уже завершена.")
 
 
+def maintenance_task(job=None):
+    """Архив, очистка и сжатие БД; не пересекается с записью загруженных файлов."""
+    with _ingest_lock:
+        return format_maintenance(run_maintenance())
+
+
+@bot.message_handler(commands=['maintenance'])
+async def handle_maintenance(message):
+    if message.from_user.id != ADMIN_ID:
+        await bot.reply_to(message, "⛔ Только админ может.")
+        return
+    await run_io(jobs.submit, "обслуживание БД", message.chat.id, maintenance_task)
+
 
 @bot.message_handler(commands=['get_excel'])
-def handle_get_excel(message):
+async def handle_get_excel(message):
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
     markup.add("📤 Weekly", "📤 Monthly")
-    bot.send_message(message.chat.id, "📁 Какой файл отправить?", reply_markup=markup)
+    await bot.send_message(message.chat.id, "📁 Какой файл отправить?", reply_markup=markup)
 
 
 @bot.message_handler(func=lambda message: message.text in ["📤 Weekly", "📤 Monthly"])
-def send_excel_file(message):
+async def send_excel_file(message):
     if message.text == "📤 Weekly":
         path = EXCEL_WEEKLY
         label = "Weekly"
@@ -395,22 +542,68 @@ def send_excel_file(message):
         label = "Monthly"
 
     if not os.path.exists(path):
-        bot.send_message(message.chat.id, f"❌ Файл {label} ещё не загружен.")
+        await bot.send_message(message.chat.id, f"❌ Файл {label} ещё не загружен.")
         return
 
     try:
         with open(path, 'rb') as f:
-            bot.send_document(message.chat.id, f, caption=f"📄 Excel-файл: {label}")
+            await bot.send_document(message.chat.id, f, caption=f"📄 Excel-файл: {label}")
     except Exception as e:
-        bot.send_message(message.chat.id, f"⚠ Ошибка при отправке: {e}")
+        await bot.send_message(message.chat.id, f"⚠ Ошибка при отправке: {e}")
+
+
+@bot.message_handler(commands=['stats'])
+async def handle_stats(message):
+    if message.from_user.id != ADMIN_ID:
+        await bot.reply_to(message, "⛔ Только админ может.")
+        return
+    await bot.reply_to(message, format_stats())
+
+
+# Замеры времени для всех обработчиков выше
+instrument_bot(bot)
 
 
 # ───────────────────────────── Планировщик и запуск ─────────────────────────────
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(weekly_broadcast, 'cron', day_of_week='sun', hour=10, minute=0)
-scheduler.start()
+async def scheduled_weekly_broadcast():
+    await run_io(weekly_broadcast)
+
 
-keep_alive()
-print("🤖 Бот запущен...")
-bot.polling(none_stop=True)
+async def scheduled_drain_outbox():
+    await run_io(drain_outbox, api)
+
+
+async def scheduled_maintenance():
+    await run_io(maintenance_task)
+
+
+async def main():
+    # Планировщик живёт в том же event loop, тяжёлую работу отдаёт в пулы
+    scheduler = AsyncIOScheduler()
+    scheduler.add_job(scheduled_weekly_broadcast, 'cron', day_of_week='sun', hour=10, minute=0)
+    scheduler.add_job(scheduled_drain_outbox, 'interval', seconds=30, max_instances=1, coalesce=True)
+    scheduler.add_job(scheduled_maintenance, 'cron', hour=3, minute=30, max_instances=1, coalesce=True)
+    scheduler.start()
+    print("🤖 Бот запущен...")
+    metrics_server = None
+    try:
+        if WEBHOOK_URL:
+            await run_webhook(bot, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT)
+        else:
+            if METRICS_PORT:
+                metrics_server = await start_metrics_server(WEBHOOK_HOST, METRICS_PORT)
+            await bot.delete_webhook()
+            await bot.infinity_polling()
+    finally:
+        if metrics_server:
+            await metrics_server.cleanup()
+        scheduler.shutdown(wait=False)
+        shutdown()
+
+
+if __name__ == '__main__':
+    startup()
+    if not WEBHOOK_URL:
+        keep_alive()  # в режиме webhook сервер уже слушает порт
+    asyncio.run(main())
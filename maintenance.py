@@ -0,0 +1,116 @@
+import os
+import shutil
+import time
+from datetime import date, timedelta
+
+from config import TEMP_DIR, ARCHIVE_DB_FILE
+from db import archive_results, prune_service_rows, compact_database
+from report import PDF_CACHE_DIR, evict_pdf_cache
+from metrics import timed
+
+# ──────────────────────── Константы ────────────────────────
+ACADEMIC_YEAR_START_MONTH = 9   # учебный год начинается 1 сентября
+KEEP_CLOSED_YEARS = 1           # закрытых учебных лет в основной БД, остальные — в архив
+SNAPSHOT_KEEP_DAYS = 14         # снимки загрузок нужны только для повторной загрузки за ту же дату
+OUTBOX_KEEP_DAYS = 30           # доставленные сообщения (ключи идемпотентности содержат дату)
+PDF_FILE_ID_KEEP_DAYS = 30      # file_id старых PDF: при запросе отчёт просто загрузится заново
+TEMP_MAX_AGE = 24 * 3600        # сек — файлы в temp/ старше удаляются
+TEMP_MAX_BYTES = 200 * 1024 * 1024
+TEMP_MIN_AGE = 15 * 60          # сек — более свежие файлы могут быть ещё в работе
+
+# ──────────────────────── Границы хранения ────────────────────────
+
+
+def archive_boundary(today: date = None) -> str:
+    """Дата, раньше которой результаты уходят в архив: начало самого старого хранимого учебного года."""
+    today = today or date.today()
+    year = today.year if today.month >= ACADEMIC_YEAR_START_MONTH else today.year - 1
+    return date(year - KEEP_CLOSED_YEARS, ACADEMIC_YEAR_START_MONTH, 1).isoformat()
+
+# ──────────────────────── Временные файлы ────────────────────────
+
+
+def _entry_size(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f))
+               for root, _, files in os.walk(path) for f in files)
+
+
+def evict_temp_files(max_age: float = TEMP_MAX_AGE, max_bytes: int = TEMP_MAX_BYTES) -> int:
+    """
+    Чистит temp/: PDF отчётов, ZIP и каталоги отчётов класса, недокачанные загрузки.
+    Удаляются записи старше max_age и самые старые сверх квоты max_bytes, но не моложе
+    TEMP_MIN_AGE. Кэш PDF вытесняется своими правилами (report.evict_pdf_cache).
+    Возвращает число удалённых файлов и каталогов.
+    """
+    if not os.path.isdir(TEMP_DIR):
+        return 0
+
+    now = time.time()
+    entries = []
+    for entry in os.scandir(TEMP_DIR):
+        if os.path.abspath(entry.path) == os.path.abspath(PDF_CACHE_DIR):
+            continue
+        try:
+            entries.append((entry.stat().st_mtime, _entry_size(entry.path), entry.path))
+        except OSError:
+            continue  # файл удалили, пока обходили каталог
+
+    removed = 0
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in sorted(entries):
+        age = now - mtime
+        if age < TEMP_MIN_AGE or (age <= max_age and total <= max_bytes):
+            break
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+# ──────────────────────── Обслуживание целиком ────────────────────────
+
+
+@timed('maintenance.run')
+def run_maintenance(today: date = None) -> dict:
+    """
+    Архив закрытых учебных лет, очистка служебных таблиц и temp/, сжатие БД.
+    Результаты раньше archive_boundary уходят из отчётов и /trend: они остаются
+    только в архивной БД и помесячной сводке.
+    Вызывается планировщиком раз в сутки и командой /maintenance.
+    """
+    today = today or date.today()
+    report = {'boundary': archive_boundary(today)}
+    report['archived'] = archive_results(report['boundary'], ARCHIVE_DB_FILE)
+    report['pruned'] = prune_service_rows(
+        (today - timedelta(days=SNAPSHOT_KEEP_DAYS)).isoformat(),
+        time.time() - OUTBOX_KEEP_DAYS * 86400,
+        time.time() - PDF_FILE_ID_KEEP_DAYS * 86400,
+    )
+    report['temp_files'] = evict_temp_files() + evict_pdf_cache()
+    report['db'] = compact_database()
+    print(f"🧹 Обслуживание: в архив {report['archived']['weekly']} недельных и "
+          f"{report['archived']['monthly']} месячных строк, БД "
+          f"{report['db']['bytes_before'] // 1024} → {report['db']['bytes_after'] // 1024} КБ")
+    return report
+
+
+def format_maintenance(report: dict) -> str:
+    """Итоги обслуживания для администратора."""
+    archived, pruned, db = report['archived'], report['pruned'], report['db']
+    return (
+        f"🗄️ В архив (до {report['boundary']}): недельных {archived['weekly']}, "
+        f"месячных {archived['monthly']}\n"
+        f"📊 Помесячных сводок: {archived['summarized']}\n"
+        f"ℹ️ Результаты до {report['boundary']} больше не попадают в отчёты и /trend\n"
+        f"🧾 Удалено служебных строк: снимков {pruned['snapshots']}, "
+        f"сообщений {pruned['outbox']}, file_id {pruned['pdf_ids']}\n"
+        f"📁 Удалено временных файлов: {report['temp_files']}\n"
+        f"🗃️ Размер БД: {db['bytes_before'] // 1024} → {db['bytes_after'] // 1024} КБ"
+    )
@@ -0,0 +1,165 @@
+import asyncio
+import functools
+import threading
+import time
+from collections import deque
+
+# ──────────────────────── Константы ────────────────────────
+SAMPLE_SIZE = 2048            # последних замеров на метрику для перцентилей
+QUANTILES = (0.5, 0.95, 0.99)
+
+# ──────────────────────── Хранилище ────────────────────────
+
+class Metric:
+    """Длительности одного действия: счётчики, сумма и окно последних замеров."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+    def quantiles(self) -> dict:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: ordered[min(len(ordered) - 1, int(len(ordered) * q))] for q in QUANTILES}
+
+
+_metrics = {}
+_lock = threading.Lock()
+_started = time.time()
+
+
+def observe(name: str, seconds: float, error: bool = False):
+    """Записывает один замер (в секундах)."""
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = Metric()
+        metric.count += 1
+        metric.errors += error
+        metric.total += seconds
+        metric.samples.append(seconds)
+
+
+def snapshot() -> dict:
+    """{имя: {'count', 'errors', 'total', 'quantiles'}} — копия под блокировкой."""
+    with _lock:
+        return {name: {'count': m.count, 'errors': m.errors, 'total': m.total, 'quantiles': m.quantiles()}
+                for name, m in _metrics.items()}
+
+
+def reset():
+    with _lock:
+        _metrics.clear()
+
+# ──────────────────────── Декораторы ────────────────────────
+
+def timed(name=None):
+    """
+    Декоратор: замеряет время вызова и ошибки. Работает и с обычными функциями,
+    и с корутинами. Без аргумента имя — «модуль.функция»: @timed или @timed('pdf.render').
+    """
+    if callable(name):
+        return timed()(name)
+
+    def decorator(fn):
+        label = name or f"{fn.__module__}.{fn.__name__}"
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                error = True
+                try:
+                    result = await fn(*args, **kwargs)
+                    error = False
+                    return result
+                finally:
+                    observe(label, time.perf_counter() - started, error)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            error = True
+            try:
+                result = fn(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                observe(label, time.perf_counter() - started, error)
+        return wrapper
+
+    return decorator
+
+
+def instrument_bot(bot):
+    """
+    Оборачивает все зарегистрированные обработчики сообщений и кнопок бота.
+    Вызывать после объявления всех обработчиков.
+    """
+    for kind, handlers in (('message', bot.message_handlers), ('callback', bot.callback_query_handlers)):
+        for handler in handlers:
+            fn = handler['function']
+            if not getattr(fn, '_timed', False):
+                handler['function'] = timed(f"handler.{fn.__name__}")(fn)
+                handler['function']._timed = True
+
+# ──────────────────────── Вывод ────────────────────────
+
+def format_stats(limit: int = 25) -> str:
+    """Текст /stats: самые затратные по суммарному времени действия."""
+    stats = snapshot()
+    if not stats:
+        return "📈 Замеров пока нет."
+    uptime = (time.time() - _started) / 3600
+    lines = [f"📈 Метрики за {uptime:.1f} ч (мс: p50 / p95 / p99)"]
+    for name, s in sorted(stats.items(), key=lambda item: -item[1]['total'])[:limit]:
+        q = s['quantiles']
+        line = f"• {name}: {s['count']} шт, {q[0.5] * 1000:.0f} / {q[0.95] * 1000:.0f} / {q[0.99] * 1000:.0f}"
+        if s['errors']:
+            line += f", ошибок {s['errors'] / s['count']:.0%}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def render_prometheus() -> str:
+    """Все метрики в текстовом формате Prometheus (summary + счётчик ошибок)."""
+    stats = snapshot()
+    lines = [
+        "# HELP bot_duration_seconds Длительность обработчиков, запросов к БД, чтения Excel и PDF.",
+        "# TYPE bot_duration_seconds summary",
+    ]
+    for name, s in sorted(stats.items()):
+        for q, value in s['quantiles'].items():
+            lines.append(f'bot_duration_seconds{{name="{name}",quantile="{q}"}} {value:.6f}')
+        lines.append(f'bot_duration_seconds_sum{{name="{name}"}} {s["total"]:.6f}')
+        lines.append(f'bot_duration_seconds_count{{name="{name}"}} {s["count"]}')
+    lines += ["# HELP bot_errors_total Вызовы, завершившиеся исключением.", "# TYPE bot_errors_total counter"]
+    for name, s in sorted(stats.items()):
+        lines.append(f'bot_errors_total{{name="{name}"}} {s["errors"]}')
+    return "\n".join(lines) + "\n"
+
+
+async def handle_metrics(request):
+    """aiohttp-обработчик GET /metrics в формате Prometheus."""
+    from aiohttp import web
+    return web.Response(text=render_prometheus(), content_type='text/plain')
+
+
+async def start_metrics_server(host: str, port: int):
+    """
+    HTTP-сервер только с /metrics — для режима polling, где webhook-приложения нет.
+    Возвращает runner; остановка — await runner.cleanup().
+    """
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"📈 Метрики: http://{host}:{port}/metrics")
+    return runner
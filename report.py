@@ -1,11 +1,120 @@
 import os
+import json
+import time
+import hashlib
+import zipfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import fpdf.fpdf
 from fpdf import FPDF
+from fpdf.ttfonts import TTFontFile
 from datetime import datetime
 from config import TEMP_DIR
+from metrics import timed
 
 # ────────────────────── Константы ──────────────────────
 FONT_PATH = 'fonts/DejaVuSans.ttf'  # Убедись, что файл существует
 FONT_NAME = 'DejaVu'
+PDF_DISK_CACHE = False                   # PDF только в памяти; True — ещё и кэш на диске
+PDF_CACHE_DIR = os.path.join(TEMP_DIR, 'pdf_cache')
+PDF_CACHE_MAX_AGE = 7 * 24 * 3600        # сек — старше удаляются
+PDF_CACHE_MAX_BYTES = 100 * 1024 * 1024  # общий размер кэша
+SUBSET_CACHE_SIZE = 16                   # готовых подмножеств шрифта в памяти
+
+# Символы, которые всегда включаются в подмножество шрифта: цифры, знаки из таблиц
+# отчёта, русская и таджикская кириллица. Так подмножество почти у всех отчётов
+# одинаковое и берётся из кэша, а лишние глифы (латиница и пр.) не раздувают PDF —
+# редкие символы из имён добавляются в подмножество конкретного документа.
+PRELOAD_CHARS = sorted({ord(c) for c in ' 0123456789.,:;%-–—()/№«»ЁёҒғӢӣҚқӮӯҲҳҶҷ'}
+                       | set(range(0x410, 0x450)))
+
+# ────────────────────── Предзагрузка шрифта ──────────────────────
+# fpdf 1.7 разбирает TTF в add_font и заново строит подмножество шрифта
+# в output() для каждого документа. Метрики разбираются один раз на процесс,
+# а готовые подмножества кэшируются по набору символов.
+
+_font_lock = threading.Lock()
+_font_metrics = None
+_subset_cache = OrderedDict()
+
+
+def preload_fonts() -> dict:
+    """Разбирает TTF один раз на процесс и возвращает общие метрики шрифта."""
+    global _font_metrics
+    with _font_lock:
+        if _font_metrics is None:
+            if not os.path.exists(FONT_PATH):
+                raise FileNotFoundError(f"❌ Не найден шрифт: {FONT_PATH}")
+            ttf = TTFontFile()
+            ttf.getMetrics(FONT_PATH)
+            _font_metrics = {
+                'name': ttf.fullName.replace(' ', '').replace('(', '').replace(')', ''),
+                'desc': {
+                    'Ascent': int(round(ttf.ascent, 0)),
+                    'Descent': int(round(ttf.descent, 0)),
+                    'CapHeight': int(round(ttf.capHeight, 0)),
+                    'Flags': ttf.flags,
+                    'FontBBox': "[%s %s %s %s]" % tuple(int(round(v, 0)) for v in ttf.bbox[:4]),
+                    'ItalicAngle': int(ttf.italicAngle),
+                    'StemV': int(round(ttf.stemV, 0)),
+                    'MissingWidth': int(round(ttf.defaultWidth, 0)),
+                },
+                'up': round(ttf.underlinePosition),
+                'ut': round(ttf.underlineThickness),
+                'cw': ttf.charWidths,
+                'originalsize': os.stat(FONT_PATH).st_size,
+            }
+    return _font_metrics
+
+
+class _Subset(list):
+    """
+    Список символов подмножества с проверкой вхождения за O(1):
+    fpdf делает `uni not in subset` на каждый выводимый символ и в _putTTfontwidths.
+    """
+
+    def __init__(self, items=()):
+        super().__init__(items)
+        self._members = set(self)
+
+    def __contains__(self, item):
+        return item in self._members
+
+    def append(self, item):
+        super().append(item)
+        self._members.add(item)
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._members = set(self)
+
+
+class _CachedTTFontFile(TTFontFile):
+    """TTFontFile, который не пересобирает одинаковые подмножества шрифта."""
+
+    def makeSubset(self, file, subset):
+        key = (file, frozenset(subset))
+        with _font_lock:
+            cached = _subset_cache.get(key)
+            if cached is not None:
+                _subset_cache.move_to_end(key)
+        if cached is not None:
+            stream, code_to_glyph, self.maxUni = cached
+            self.codeToGlyph = dict(code_to_glyph)
+            return stream
+
+        stream = super().makeSubset(file, subset)
+        with _font_lock:
+            _subset_cache[key] = (stream, dict(self.codeToGlyph), self.maxUni)
+            while len(_subset_cache) > SUBSET_CACHE_SIZE:
+                _subset_cache.popitem(last=False)
+        return stream
+
+
+# FPDF._putfonts создаёт TTFontFile через глобальное имя модуля fpdf.fpdf
+fpdf.fpdf.TTFontFile = _CachedTTFontFile
 
 # ────────────────────── Класс PDF ──────────────────────
 
@@ -13,6 +122,26 @@ class PDFReport(FPDF):
     def __init__(self, report_type='weekly'):
         super().__init__()
         self.report_type = report_type
+        self.add_shared_font('')
+        self.add_shared_font('B')
+
+    def add_shared_font(self, style=''):
+        """Аналог add_font(..., uni=True) на предзагруженных метриках, без чтения TTF."""
+        metrics = preload_fonts()
+        fontkey = FONT_NAME.lower() + style
+        if fontkey in self.fonts:
+            return
+        subset = list(range(0, 57)) if hasattr(self, 'str_alias_nb_pages') else list(range(0, 32))
+        self.fonts[fontkey] = {
+            'i': len(self.fonts) + 1, 'type': 'TTF',
+            'name': metrics['name'], 'desc': metrics['desc'],
+            'up': metrics['up'], 'ut': metrics['ut'],
+            'cw': metrics['cw'],
+            'ttffile': FONT_PATH, 'fontkey': fontkey,
+            'subset': _Subset(subset + PRELOAD_CHARS), 'unifilename': None,
+        }
+        self.font_files[fontkey] = {'length1': metrics['originalsize'], 'type': 'TTF', 'ttffile': FONT_PATH}
+        self.font_files[FONT_PATH] = {'type': 'TTF'}
 
     def header(self):
         self.set_font(FONT_NAME, 'B', 16)
@@ -43,12 +172,16 @@ class PDFReport(FPDF):
 
         self.set_font(FONT_NAME, '', 11)
 
+        # значения уже в шкале хранения БД: проценты 0–100 и баллы
         def fmt(val):
-            try:
-                fval = float(val)
-                return f"{int(fval)}%" if fval > 1 else f"{int(fval * 100)}%"
-            except Exception:
-                return str(val).strip()
+            if isinstance(val, (int, float)):
+                return f"{val:.0f}%"
+            return str(val if val is not None else '').strip()
+
+        def points(val):
+            if isinstance(val, (int, float)):
+                return f"{val:g}"
+            return str(val if val is not None else '').strip()
 
         for rec in records:
             date_str = datetime.strptime(rec['date'], "%Y-%m-%d").strftime("%d.%m.%Y")
@@ -66,12 +199,12 @@ class PDFReport(FPDF):
             else:
                 row = [
                     date_str,
-                    str(subj.get('таджикский язык', '')),
-                    str(subj.get('биология', '')),
-                    str(subj.get('химия', '')),
-                    str(subj.get('физика', '')),
-                    str(subj.get('общий балл', '')),
-                    fmt(subj.get('общий процент', subj.get('общий процент', '')))
+                    points(subj.get('таджикский язык', '')),
+                    points(subj.get('биология', '')),
+                    points(subj.get('химия', '')),
+                    points(subj.get('физика', '')),
+                    points(subj.get('общий балл', '')),
+                    fmt(subj.get('общий процент', ''))
                 ]
 
             for i, item in enumerate(row):
@@ -80,23 +213,145 @@ class PDFReport(FPDF):
 
 # ────────────────────── Генерация PDF ──────────────────────
 
-def generate_progress_pdf(student_name, records, report_type='weekly'):
-    if not os.path.exists(TEMP_DIR):
-        os.makedirs(TEMP_DIR)
-
-    if not os.path.exists(FONT_PATH):
-        raise FileNotFoundError(f"❌ Не найден шрифт: {FONT_PATH}")
-
+@timed('pdf.render')
+def render_pdf(student_name, records, report_type='weekly') -> bytes:
+    """Рендерит отчёт в память и возвращает содержимое PDF."""
     pdf = PDFReport(report_type=report_type)
-    pdf.add_font(FONT_NAME, '', FONT_PATH, uni=True)
-    pdf.add_font(FONT_NAME, 'B', FONT_PATH, uni=True)
-
     pdf.add_page()
     pdf.add_student_results(student_name, records)
+    return pdf.output(dest='S').encode('latin-1')  # fpdf 1.7 отдаёт байты строкой latin-1
+
+
+def _write_atomic(filepath, data: bytes):
+    """Запись через временный файл: читатель не увидит недописанный PDF."""
+    tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, filepath)
 
-    safe_name = ''.join(c for c in student_name if c.isalnum() or c in (' ', '_')).strip().replace(' ', '_')
-    filename = f"{safe_name}_progress_{report_type}.pdf"
-    filepath = os.path.join(TEMP_DIR, filename)
 
-    pdf.output(filepath)
-    return filepath
+def safe_filename(student_name) -> str:
+    return ''.join(c for c in student_name if c.isalnum() or c in (' ', '_')).strip().replace(' ', '_')
+
+
+def progress_filename(student_name, report_type='weekly') -> str:
+    """Имя файла, под которым отчёт видит родитель."""
+    return f"{safe_filename(student_name)}_progress_{report_type}.pdf"
+
+
+@timed('pdf.generate_progress')
+def generate_progress_pdf(student_name, records, report_type='weekly') -> bytes:
+    """PDF-прогресс ученика в памяти — без временного файла и гонок за его имя."""
+    return render_pdf(student_name, records, report_type)
+
+# ────────────────────── Пакетная генерация для класса ──────────────────────
+
+def _render_student(job):
+    """Рабочая функция процесса: все отчёты одного ученика → список путей."""
+    student_name, histories, out_dir = job
+    paths = []
+    for report_type, records in histories.items():
+        if not records:
+            continue
+        filepath = os.path.join(out_dir, progress_filename(student_name, report_type))
+        _write_atomic(filepath, render_pdf(student_name, records, report_type))
+        paths.append(filepath)
+    return paths
+
+
+def generate_class_reports(histories: dict, out_dir: str, zip_path: str = None, workers: int = None) -> dict:
+    """
+    Рендерит недельные и месячные отчёты всего класса в пуле процессов.
+    histories — {имя: {'weekly': [...], 'monthly': [...]}} (одно чтение из БД на весь класс).
+    Если указан zip_path, PDF дополнительно упаковываются в один ZIP.
+    Возвращает {'files': [пути], 'errors': [(имя, ошибка)], 'zip': путь или None}.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(name, h, out_dir) for name, h in histories.items()]
+    files, errors = [], []
+
+    # spawn, а не fork: бот многопоточный, и форк мог бы унаследовать захваченные блокировки
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [(job[0], pool.submit(_render_student, job)) for job in jobs]
+        for name, future in futures:
+            try:
+                files.extend(future.result())
+            except Exception as e:
+                errors.append((name, str(e)))
+
+    if zip_path:
+        with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            for path in files:
+                zf.write(path, arcname=os.path.basename(path))
+
+    return {'files': files, 'errors': errors, 'zip': zip_path}
+
+# ────────────────────── Кэш PDF ──────────────────────
+# Отчёты рендерятся в память; повторную загрузку в Telegram и так исключает
+# file_id в БД. Дисковый кэш — необязательный: при PDF_DISK_CACHE файл
+# адресуется хэшем от (ученик, тип отчёта, записи), поэтому новые данные в БД
+# автоматически дают новый ключ, а старые файлы вытесняются по возрасту и размеру.
+
+_evict_lock = threading.Lock()
+
+
+def pdf_cache_key(student_name, records, report_type='weekly') -> str:
+    """Ключ кэша: хэш имени, типа отчёта и содержимого записей."""
+    raw = json.dumps([student_name, report_type, records], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+@timed('pdf.cached_progress')
+def get_cached_progress_pdf(student_name, records, report_type='weekly', disk_cache: bool = None):
+    """
+    Возвращает (содержимое PDF, ключ). С дисковым кэшем PDF рендерится, только
+    если для этих данных его ещё нет в кэше; ошибки диска не мешают отправке.
+    """
+    key = pdf_cache_key(student_name, records, report_type)
+    if not (PDF_DISK_CACHE if disk_cache is None else disk_cache):
+        return render_pdf(student_name, records, report_type), key
+
+    filepath = os.path.join(PDF_CACHE_DIR, f"{key}.pdf")
+    try:
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        os.utime(filepath)  # отметка использования для LRU-вытеснения
+        return data, key
+    except OSError:
+        pass
+
+    data = render_pdf(student_name, records, report_type)
+    try:
+        os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+        _write_atomic(filepath, data)
+        evict_pdf_cache()
+    except OSError as e:
+        print(f"⚠ Не удалось сохранить PDF в кэш: {e}")
+    return data, key
+
+
+def evict_pdf_cache(max_age: float = PDF_CACHE_MAX_AGE, max_bytes: int = PDF_CACHE_MAX_BYTES) -> int:
+    """Удаляет устаревшие файлы и самые давно использованные сверх квоты. Возвращает число удалённых."""
+    if not os.path.isdir(PDF_CACHE_DIR):
+        return 0
+
+    with _evict_lock:
+        now = time.time()
+        files = []
+        for entry in os.scandir(PDF_CACHE_DIR):
+            if entry.is_file() and entry.name.endswith('.pdf'):
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+
+        removed = 0
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in sorted(files):
+            if now - mtime <= max_age and total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,32 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# ──────────────────────── Исполнители для блокирующей работы ────────────────────────
+# Обработчики бота — корутины в одном event loop. Всё блокирующее (SQLite, pandas,
+# openpyxl, fpdf) уходит в ограниченные пулы потоков, чтобы loop не стоял и время
+# ответа родителям не зависело от чужих тяжёлых запросов.
+
+IO_WORKERS = 16    # БД, Excel, файлы, синхронные вызовы Telegram API
+CPU_WORKERS = 2    # рендер PDF (держит GIL — больше потоков не ускорит)
+
+io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='io')
+cpu_pool = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix='cpu')
+
+
+async def run_io(fn, *args, **kwargs):
+    """Выполняет блокирующую функцию в пуле ввода-вывода и ждёт результат."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_pool, functools.partial(fn, *args, **kwargs))
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Выполняет тяжёлую вычислительную функцию (PDF) в отдельном небольшом пуле."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_pool, functools.partial(fn, *args, **kwargs))
+
+
+def shutdown():
+    """Останавливает пулы; вызывается при выходе из event loop."""
+    io_pool.shutdown(wait=False, cancel_futures=True)
+    cpu_pool.shutdown(wait=False, cancel_futures=True)
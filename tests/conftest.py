@@ -0,0 +1,13 @@
+import pytest
+
+import db
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Пустая БД последней версии схемы во временном каталоге. Возвращает путь к файлу."""
+    path = str(tmp_path / 'bot.db')
+    monkeypatch.setattr(db, 'DB_PATH', path)
+    db.init_db()
+    yield path
+    db.close_connection()
@@ -0,0 +1,39 @@
+import pytest
+
+import analytics
+import db
+
+
+@pytest.fixture
+def fresh_db(database):
+    analytics.invalidate()
+    yield
+    analytics.invalidate()
+
+
+def _week(upload, broadcast, mark):
+    """Неделя, как её пишет бот: загрузка файла и сохранение при воскресной рассылке."""
+    for day in (upload, broadcast):
+        db.bulk_upsert_weekly_results([('Ученик', 'Химия', mark)], day)
+
+
+def test_upload_and_broadcast_dates_count_as_one_week(fresh_db):
+    _week('2025-01-06', '2025-01-12', 0.5)
+    _week('2025-01-13', '2025-01-19', 0.9)
+
+    _, trend = analytics.get_student_trend('ученик')
+    assert trend['химия']['value'] == 90.0
+    assert trend['химия']['delta'] == 40.0
+    assert trend['химия']['moving_avg'] == 70.0
+
+
+def test_window_spans_calendar_weeks(fresh_db):
+    for n, (upload, broadcast) in enumerate([
+            ('2024-12-02', '2024-12-08'), ('2024-12-09', '2024-12-15'), ('2024-12-16', '2024-12-22'),
+            ('2024-12-23', '2024-12-29'), ('2024-12-30', '2025-01-05')]):
+        _week(upload, broadcast, 10 * (n + 1))
+
+    rows = db.get_recent_weekly_scores(analytics.MOVING_WEEKS)
+    assert min(r[0] for r in rows) == '2024-12-09'
+    _, trend = analytics.get_student_trend('ученик')
+    assert trend['химия']['moving_avg'] == 35.0
@@ -0,0 +1,104 @@
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+import broadcast
+import db
+
+
+class FakeBot:
+    def __init__(self, blocked=(), flood=0, retry_after=0.01):
+        self.sent = []
+        self.blocked = set(blocked)
+        self.flood = flood  # столько первых вызовов отвечают 429
+        self.retry_after = retry_after
+        self.calls = 0
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        if self.calls <= self.flood:
+            raise ApiTelegramException('sendMessage', None, {
+                'error_code': 429, 'description': 'Too Many Requests',
+                'parameters': {'retry_after': self.retry_after}})
+        if chat_id in self.blocked:
+            raise ApiTelegramException('sendMessage', None,
+                                       {'error_code': 403, 'description': 'bot was blocked'})
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture
+def outbox_db(database, monkeypatch):
+    monkeypatch.setattr(broadcast, 'PER_CHAT_INTERVAL', 0.0)
+    monkeypatch.setattr(broadcast, 'GLOBAL_RATE', 1e6)
+    monkeypatch.setattr(broadcast, 'GLOBAL_BURST', 1e6)
+
+
+def test_drain_sends_more_than_one_claim(outbox_db):
+    db.enqueue_outbox((f"k{i}", str(i), f"текст {i}", {}) for i in range(1500))
+
+    report = broadcast.drain_outbox(FakeBot())
+
+    assert (report['total'], report['sent']) == (1500, 1500)
+    assert db.get_outbox_stats() == {'sent': 1500}
+
+
+def test_drain_stops_on_permanent_failures(outbox_db):
+    db.enqueue_outbox((f"k{i}", str(i), "текст", {}) for i in range(3))
+
+    report = broadcast.drain_outbox(FakeBot(blocked={'1'}))
+
+    assert (report['total'], report['sent'], len(report['failed'])) == (3, 2, 1)
+    assert db.get_outbox_stats() == {'sent': 2, 'failed': 1}
+
+
+def test_failing_on_result_does_not_stop_dispatch(outbox_db):
+    def on_result(key, error):
+        raise db.sqlite3.OperationalError('database is locked')
+
+    report = broadcast.dispatch(FakeBot(), [('1', 'a', {}, 1), ('2', 'b', {}, 2)], on_result=on_result)
+
+    assert report['sent'] == 2
+
+
+def test_stale_sending_rows_are_reclaimed(outbox_db):
+    db.enqueue_outbox([('k1', '1', 'текст', {})])
+    assert len(db.claim_outbox(lease=0.0)) == 1  # исход так и не записан
+
+    report = broadcast.drain_outbox(FakeBot())
+
+    assert report['sent'] == 1
+    assert db.get_outbox_stats() == {'sent': 1}
+
+
+@pytest.fixture
+def pauses(monkeypatch):
+    calls = []
+    pause = broadcast.TokenBucket.pause
+
+    def spy(self, seconds):
+        calls.append(seconds)
+        pause(self, seconds)
+
+    monkeypatch.setattr(broadcast.TokenBucket, 'pause', spy)
+    return calls
+
+
+def test_rate_limited_message_is_retried_after_pause(outbox_db, pauses):
+    bot = FakeBot(flood=2)
+
+    report = broadcast.dispatch(bot, [('1', 'текст')])
+
+    assert bot.sent == [('1', 'текст')]
+    assert (report['sent'], report['retries'], report['failed']) == (1, 2, [])
+    assert pauses == [0.01, 0.01]
+
+
+def test_rate_limit_exhausting_retries_is_reported(outbox_db, pauses, monkeypatch):
+    monkeypatch.setattr(broadcast, 'MAX_RETRIES', 2)
+    results = []
+
+    report = broadcast.dispatch(FakeBot(flood=10), [('1', 'текст', {}, 'k')],
+                                on_result=lambda key, error: results.append((key, error.error_code)))
+
+    assert (report['sent'], report['retries'], len(report['failed'])) == (0, 2, 1)
+    assert results == [('k', 429)]
+    assert pauses == [0.01, 0.01]
@@ -0,0 +1,66 @@
+import pytest
+from openpyxl import Workbook
+
+import db
+from ingest import ingest_workbook
+
+
+def _weekly(path, rows, header=('Имя ученика', 'Телефон родителя', 'Химия', 'Физика')):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(list(header))
+    for row in rows:
+        ws.append(list(row))
+    wb.save(path)
+    return str(path)
+
+
+def test_diff_reports_names_as_written_in_file(database, tmp_path):
+    first = _weekly(tmp_path / 'first.xlsx', [
+        ('Зуфарова Аниса', '900', 0.5, 0.6),
+        ('Каримов Али', '901', 0.7, 0.8),
+    ])
+    diff = ingest_workbook(first, 'weekly', '2025-01-06')
+    assert diff['added'] == ['Зуфарова Аниса', 'Каримов Али']
+
+    second = _weekly(tmp_path / 'second.xlsx', [('Каримов Али', '901', 0.9, 0.8)])
+    diff = ingest_workbook(second, 'weekly', '2025-01-06')
+
+    assert diff['changed'] == ['Каримов Али']
+    assert diff['removed'] == ['Зуфарова Аниса']
+    assert db.get_last_weekly_results('зуфарова аниса') == []
+    assert dict((s, m) for s, m, _ in db.get_last_weekly_results('каримов али')) == {'химия': 90.0, 'физика': 80.0}
+
+
+def test_wrong_header_reupload_keeps_previous_results(database, tmp_path):
+    first = _weekly(tmp_path / 'first.xlsx', [('Каримов Али', '901', 0.7, 0.8)])
+    ingest_workbook(first, 'weekly', '2025-01-06')
+
+    wrong = _weekly(tmp_path / 'wrong.xlsx', [('Каримов Али', '901', 0.9, 0.9)],
+                    header=('ФИО', 'Телефон', 'Химия', 'Физика'))
+    with pytest.raises(ValueError):
+        ingest_workbook(wrong, 'weekly', '2025-01-06')
+
+    other = _weekly(tmp_path / 'other.xlsx', [('Рахимов Умед', '902', 0.9, 0.9)])
+    with pytest.raises(ValueError):
+        ingest_workbook(other, 'weekly', '2025-01-06')
+
+    assert dict((s, m) for s, m, _ in db.get_last_weekly_results('каримов али')) == {'химия': 70.0, 'физика': 80.0}
+    assert db.get_upload_snapshot('weekly', '2025-01-06').keys() == {'каримов али'}
+
+
+def test_cancel_during_parse_writes_nothing(database, tmp_path, monkeypatch):
+    monkeypatch.setattr('ingest.PROGRESS_EVERY', 2)
+    rows = [(f'Ученик {i}', str(900 + i), 0.5, 0.5) for i in range(5)]
+    path = _weekly(tmp_path / 'big.xlsx', rows)
+
+    def cancel(n):
+        with db.connection() as conn:  # разбор идёт вне транзакции записи
+            assert not conn.in_transaction
+        raise RuntimeError('cancelled')
+
+    with pytest.raises(RuntimeError):
+        ingest_workbook(path, 'weekly', '2025-01-06', batch_size=2, progress=cancel)
+
+    assert db.get_last_weekly_results('ученик 0') == []
+    assert db.get_upload_snapshot('weekly', '2025-01-06') == {}
@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import time
+from datetime import date
+
+import pytest
+
+import db
+import maintenance
+
+
+@pytest.fixture
+def workdir(database, tmp_path, monkeypatch):
+    monkeypatch.setattr(maintenance, 'ARCHIVE_DB_FILE', str(tmp_path / 'archive.db'))
+    monkeypatch.setattr(maintenance, 'TEMP_DIR', str(tmp_path / 'temp'))
+    monkeypatch.setattr(maintenance, 'PDF_CACHE_DIR', str(tmp_path / 'temp' / 'pdf_cache'))
+    os.makedirs(tmp_path / 'temp')
+    return tmp_path
+
+
+def test_old_years_move_to_archive_and_summaries(workdir):
+    rows = [('Ученик', 'Химия', mark / 100, day) for mark, day in
+            ((40, '2023-10-01'), (60, '2023-10-08'), (80, '2025-10-05'))]
+    db.bulk_save_weekly_results(rows)
+    db.bulk_save_monthly_results([('Ученик', 'Химия', 120, '2023-10-01')])
+
+    report = maintenance.run_maintenance(date(2025, 10, 18))
+
+    assert report['boundary'] == '2024-09-01'
+    assert report['archived'] == {'weekly': 2, 'monthly': 1, 'summarized': 1}
+    assert [d for _, _, d in db.get_all_weekly_results('ученик')] == ['2025-10-05']
+    with db.connection() as conn:
+        assert tuple(conn.execute("SELECT mark, weeks FROM weekly_monthly").fetchone()) == (50.0, 2)
+    archive = sqlite3.connect(str(workdir / 'archive.db'))
+    assert archive.execute("SELECT COUNT(*) FROM weekly_results").fetchone()[0] == 2
+
+    # повторный запуск ничего не переносит и не удваивает сводку
+    assert maintenance.run_maintenance(date(2025, 10, 18))['archived']['summarized'] == 0
+
+
+def test_compaction_is_incremental(workdir):
+    db.bulk_save_weekly_results(
+        (f"ученик {i}", 'химия', 0.5, '2020-01-05') for i in range(20000))
+    with db.connection() as conn:
+        conn.execute("DELETE FROM weekly_results")
+
+    result = db.compact_database()
+
+    assert result['bytes_after'] < result['bytes_before']
+    with db.connection() as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+
+
+def test_temp_eviction_keeps_fresh_files(workdir):
+    temp = workdir / 'temp'
+    old, fresh = temp / 'old_progress.pdf', temp / 'fresh_progress.pdf'
+    old.write_bytes(b'%PDF')
+    fresh.write_bytes(b'%PDF')
+    stale = time.time() - maintenance.TEMP_MAX_AGE - 60
+    os.utime(old, (stale, stale))
+
+    assert maintenance.evict_temp_files() == 1
+    assert sorted(os.listdir(temp)) == ['fresh_progress.pdf']
@@ -0,0 +1,34 @@
+import asyncio
+import socket
+
+import aiohttp
+
+import metrics
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_metrics_server_serves_prometheus_text():
+    @metrics.timed('test.sample')
+    def sample():
+        return 1
+
+    sample()
+
+    async def scrape():
+        port = _free_port()
+        runner = await metrics.start_metrics_server('127.0.0.1', port)
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                    return response.status, await response.text()
+        finally:
+            await runner.cleanup()
+
+    status, text = asyncio.run(scrape())
+    assert status == 200
+    assert 'bot_duration_seconds_count{name="test.sample"}' in text
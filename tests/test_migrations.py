@@ -0,0 +1,64 @@
+import sqlite3
+
+import pytest
+
+import db
+
+# Версия схемы, в которой оценки ещё хранились текстом
+TEXT_MARKS_VERSION = 8
+
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    """БД в схеме до миграции 9 с оценками в тех видах, что встречались в Excel."""
+    path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(path)
+    monkeypatch.setattr(db, 'MIGRATIONS', db.MIGRATIONS[:TEXT_MARKS_VERSION])
+    db.migrate(conn)
+    monkeypatch.undo()
+
+    weekly = [
+        ('химия', '85%'), ('физика', '0,85'), ('биология', ' 70'), ('таджикский язык', '1e'),
+        ('общий процент', '0.5'), ('астрономия', 'н/я'), ('история', '92'),
+    ]
+    conn.executemany(
+        "INSERT INTO weekly_results (student_name, subject, mark, date) VALUES ('ученик', ?, ?, '2025-01-05')",
+        weekly)
+    monthly = [('химия', '120'), ('биология', ' 75,5'), ('общий процент', '0,7'), ('физика', '-')]
+    conn.executemany(
+        "INSERT INTO results (name, subject, score, date) VALUES ('ученик', ?, ?, '2025-01-01')",
+        monthly)
+    conn.commit()
+    return conn
+
+
+def _values(conn, table, value_col):
+    return dict(conn.execute(
+        f"SELECT s.name, t.{value_col} FROM {table} t JOIN subjects s ON s.id = t.subject_id"))
+
+
+def test_text_marks_follow_ingest_rules(legacy_db):
+    db.migrate(legacy_db)
+
+    weekly = _values(legacy_db, 'weekly_results', 'mark')
+    assert weekly == {
+        'химия': 85.0,
+        'физика': 85.0,
+        'биология': 70.0,
+        'таджикский язык': None,
+        'общий процент': 50.0,
+        'астрономия': None,
+        'история': 92.0,
+    }
+
+    monthly = _values(legacy_db, 'results', 'score')
+    assert monthly == {'химия': 120.0, 'биология': 75.5, 'общий процент': 70.0, 'физика': None}
+
+
+def test_migrated_rows_keep_unique_key(legacy_db):
+    db.migrate(legacy_db)
+
+    with pytest.raises(sqlite3.IntegrityError):
+        legacy_db.execute(
+            "INSERT INTO weekly_results (student_name, subject_id, mark, date) "
+            "SELECT 'ученик', id, 1, '2025-01-05' FROM subjects WHERE name = 'химия'")
@@ -0,0 +1,52 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import SECRET_HEADER, WEBHOOK_PATH, create_app
+
+
+class RecordingBot:
+    def __init__(self, fail_first: bool = False):
+        self.updates = []
+        self.fail_first = fail_first
+
+    async def process_new_updates(self, updates):
+        if self.fail_first:
+            self.fail_first = False
+            raise RuntimeError("сбой обработчика")
+        self.updates.extend(u.update_id for u in updates)
+
+
+def _run(bot, bodies, secret='secret'):
+    async def scenario():
+        app = create_app(bot, 'secret', workers=1)
+        async with TestClient(TestServer(app)) as client:
+            statuses = []
+            for body in bodies:
+                response = await client.post(WEBHOOK_PATH, data=body, headers={SECRET_HEADER: secret})
+                statuses.append(response.status)
+            await app['queue'].join()
+            return statuses
+
+    return asyncio.run(scenario())
+
+
+def test_non_object_payloads_are_rejected():
+    bot = RecordingBot()
+    statuses = _run(bot, ['[1, 2]', '42', '"x"', 'null', '{"update_id": 7}'])
+    assert statuses == [400, 400, 400, 400, 200]
+    assert bot.updates == [7]
+
+
+def test_worker_survives_handler_error():
+    bot = RecordingBot(fail_first=True)
+    statuses = _run(bot, ['{"update_id": 1}', '{"update_id": 2}'])
+    assert statuses == [200, 200]
+    assert bot.updates == [2]
+
+
+def test_non_ascii_secret_header_is_forbidden():
+    bot = RecordingBot()
+    statuses = _run(bot, ['{"update_id": 1}'], secret='секрет')
+    assert statuses == [403]
+    assert bot.updates == []
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+from db import META_COLUMNS
+
+# ──────────────────────── Векторные преобразования таблиц ────────────────────────
+# Весь лист преобразуется за один проход: широкая таблица → длинный формат
+# (ученик, предмет, значение), числа и проценты считаются по колонкам сразу,
+# без iterrows и построчных astype/to_dict.
+
+SUBJECT_EMOJIS = {
+    'таджикский язык': '📚',
+    'биология': '🌱',
+    'химия': '🧪',
+    'физика': '⚡️',
+    'общий процент': '📊'
+}
+
+MONTHLY_MAXIMUMS = {
+    'Таджикский язык': 75,
+    'Биология': 150,
+    'Химия': 175,
+    'Физика': 100,
+    'Общий балл': 500,
+}
+
+
+def to_percent(values: pd.Series) -> pd.Series:
+    """Доли (≤ 1) переводятся в проценты, значения > 1 считаются процентами; округление до целого."""
+    return values.where(values > 1, values * 100).round()
+
+
+def weekly_long(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Еженедельный лист в длинном формате, по строке на (ученик, предмет):
+    row, name, phone, subject, raw, value (float или NaN), label ('85%' или исходный текст).
+    Строки без имени ученика отбрасываются.
+    """
+    columns = ['row', 'name', 'phone', 'subject', 'raw', 'value', 'label']
+    if df is None or 'Имя ученика' not in df.columns:
+        return pd.DataFrame(columns=columns)
+
+    subjects = [c for c in df.columns if c not in META_COLUMNS]
+    if not subjects:
+        return pd.DataFrame(columns=columns)
+    names = df['Имя ученика']
+    base = df[names.notna() & (names.astype(str).str.strip() != '')]
+
+    wide = pd.DataFrame({
+        'row': np.arange(len(base)),
+        'name': base['Имя ученика'].astype(str).to_numpy(),
+        'phone': base['Телефон родителя'].to_numpy() if 'Телефон родителя' in base.columns else None,
+    })
+    wide[subjects] = base[subjects].to_numpy()
+
+    long = wide.melt(id_vars=['row', 'name', 'phone'], value_vars=subjects,
+                     var_name='subject', value_name='raw')
+    long['subject'] = long['subject'].astype(str).str.strip()
+    value = pd.to_numeric(long['raw'], errors='coerce')
+    long['value'] = value.where(np.isfinite(value))
+    percent = to_percent(long['value'])
+    long['label'] = np.where(
+        long['value'].notna(),
+        percent.astype('Int64').astype(str) + '%',
+        long['raw'].astype(str),
+    )
+    # melt группирует по предмету — возвращаем порядок «ученик, затем предметы как в файле»
+    long = long.sort_values('row', kind='stable').reset_index(drop=True)
+    return long[columns]
+
+
+def weekly_summaries(df: pd.DataFrame) -> list:
+    """
+    Сводка по каждому ученику: {'name', 'phone', 'values': {предмет: float|None},
+    'labels': {предмет: текст}, 'valid': все оценки числовые}.
+    """
+    long = weekly_long(df)
+    summaries = []
+    current = None
+    for row, name, phone, subject, value, label in zip(
+            long['row'], long['name'], long['phone'], long['subject'], long['value'], long['label']):
+        if row != current:
+            current = row
+            summary = {'name': name, 'phone': phone, 'values': {}, 'labels': {}, 'valid': True}
+            summaries.append(summary)
+        if value != value:  # NaN
+            summary['valid'] = False
+            summary['values'][subject] = None
+        else:
+            summary['values'][subject] = float(value)
+        summary['labels'][subject] = label
+    return summaries
+
+
+def format_weekly_results(name: str, labels: dict) -> str:
+    """Текст /results: предметы с эмодзи и процентами."""
+    text = f"*Результаты прошедшей недели для {name}:*\n\n"
+    for subject, mark in labels.items():
+        subject = subject.lower()
+        emoji = SUBJECT_EMOJIS.get(subject, '🔹')
+        text += f"{emoji} {subject.capitalize()}: {mark}\n"
+    return text
+
+
+def format_weekly_broadcast(name: str, labels: dict) -> str:
+    """Текст еженедельной рассылки."""
+    text_lines = [f"🧪 {subject}: {mark}" for subject, mark in labels.items()]
+    return f"📅 Итоги недели для *{name}*:\n\n" + "\n".join(text_lines)
+
+
+def monthly_texts(df: pd.DataFrame) -> list:
+    """[(имя, текст месячного отчёта)] для всех строк ежемесячного листа."""
+    if df is None or df.empty:
+        return []
+    names = df['Имя ученика'].astype(str).str.strip()
+    text = "📅 *Месячный отчёт для " + names + "*:\n\n"
+    for col, emoji in (('Таджикский язык', '📚'), ('Биология', '🌱'), ('Химия', '🧪'),
+                       ('Физика', '⚡️'), ('Общий балл', '📊')):
+        text += f"{emoji} {col}: " + df[col].astype(str) + f" из {MONTHLY_MAXIMUMS[col]}\n"
+    text += "✅ Процент: " + df['Общий процент'].astype(str) + "%"
+    return list(zip(names, text))
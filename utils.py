@@ -1,8 +1,13 @@
 import json
 import os
+import threading
 import pandas as pd
-from typing import Tuple, Optional
+from openpyxl import load_workbook
+from typing import Iterator, Tuple, Optional
 from config import EXCEL_WEEKLY, EXCEL_MONTHLY, BINDINGS_FILE
+from db import get_all_bindings, upsert_bindings, replace_weekly_snapshots, load_weekly_snapshots
+from transforms import weekly_summaries, format_weekly_results, format_weekly_broadcast
+from metrics import timed
 
 # ──────────────────────── Утилита для очистки номера ────────────────────────
 
@@ -11,79 +16,321 @@ def clean_phone(phone: str) -> str:
     return phone.strip().replace(' ', '').replace('\u200b', '')
 
 # ──────────────────────── Работа с привязками ────────────────────────
+# Привязки хранятся в таблице bindings (SQLite). Чтение идёт из кэша в памяти,
+# который заполняется при первом обращении; запись — атомарный upsert одной строки.
+
+_bindings_lock = threading.Lock()
+_bindings_cache = None
+
+
+def import_bindings_json() -> int:
+    """
+    Однократный перенос bindings.json в БД. После импорта файл
+    переименовывается в bindings.json.imported. Возвращает число привязок.
+    """
+    if not os.path.exists(BINDINGS_FILE):
+        return 0
+    try:
+        with open(BINDINGS_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except json.JSONDecodeError:
+        data = {}
+
+    count = upsert_bindings((cid, clean_phone(str(phone))) for cid, phone in data.items())
+    os.replace(BINDINGS_FILE, BINDINGS_FILE + '.imported')
+    invalidate_bindings()
+    print(f"👤 Импортировано привязок из {BINDINGS_FILE}: {count}")
+    return count
+
+
+def invalidate_bindings() -> None:
+    global _bindings_cache
+    with _bindings_lock:
+        _bindings_cache = None
+
+
+def _bindings() -> Tuple[dict, dict]:
+    """(chat_id → телефон, телефон → [chat_id]) из кэша."""
+    global _bindings_cache
+    with _bindings_lock:
+        if _bindings_cache is None:
+            by_chat = get_all_bindings()
+            by_phone = {}
+            for chat_id, phone in by_chat.items():
+                by_phone.setdefault(phone, []).append(chat_id)
+            _bindings_cache = (by_chat, by_phone)
+        return _bindings_cache
+
 
 def load_bindings() -> dict:
-    """Загружает словарь привязок chat_id → телефон из JSON."""
-    if os.path.exists(BINDINGS_FILE):
-        try:
-            with open(BINDINGS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return {}
-    return {}
-
-def save_bindings(bindings: dict) -> None:
-    """Сохраняет привязки chat_id → телефон в JSON."""
-    with open(BINDINGS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(bindings, f, ensure_ascii=False, indent=2)
+    """Копия словаря привязок chat_id → телефон."""
+    return dict(_bindings()[0])
+
+
+def get_binding(chat_id) -> Optional[str]:
+    """Телефон, привязанный к chat_id, или None."""
+    return _bindings()[0].get(str(chat_id))
+
+
+def save_binding(chat_id, phone: str) -> None:
+    """Сохраняет (или заменяет) привязку одного chat_id."""
+    chat_id, phone = str(chat_id), clean_phone(phone)
+    upsert_bindings([(chat_id, phone)])
+    with _bindings_lock:
+        if _bindings_cache is None:
+            return
+        by_chat, by_phone = _bindings_cache
+        old = by_chat.get(chat_id)
+        if old is not None and chat_id in by_phone.get(old, []):
+            by_phone[old].remove(chat_id)
+        by_chat[chat_id] = phone
+        by_phone.setdefault(phone, []).append(chat_id)
+
+# ──────────────────────── Кэш еженедельного списка учеников ────────────────────────
+
+_roster_lock = threading.Lock()
+_EMPTY_ROSTER = {'key': None, 'df': None, 'by_phone': {}, 'by_name': {}, 'name_conflicts': {},
+                 'summaries': {}}
+_roster = dict(_EMPTY_ROSTER)
+
+
+def _file_key(path: str) -> Optional[Tuple[int, int]]:
+    """Версия файла: (mtime в наносекундах, размер). None, если файла нет."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def normalize_name(name) -> str:
+    """Имя для сравнения: без лишних пробелов, в нижнем регистре."""
+    return ' '.join(str(name).split()).lower()
+
+
+def invalidate_roster() -> None:
+    """Сбрасывает кэш — вызывается после загрузки нового weekly.xlsx."""
+    with _roster_lock:
+        _roster.clear()
+        _roster.update(_EMPTY_ROSTER)
+
+
+def _build_name_index(df: pd.DataFrame) -> Tuple[dict, dict]:
+    """
+    Обратный индекс имя → телефоны родителей (без повторов, в порядке файла)
+    и список конфликтов: имена, встречающиеся в файле больше одного раза.
+    """
+    by_name, counts = {}, {}
+    if 'Имя ученика' not in df.columns or 'Телефон родителя' not in df.columns:
+        return by_name, {}
+
+    for name, phone in zip(df['Имя ученика'], df['Телефон родителя']):
+        if not isinstance(name, str) or not name.strip():
+            continue
+        key = normalize_name(name)
+        counts[key] = counts.get(key, 0) + 1
+        phones = by_name.setdefault(key, [])
+        if phone not in phones:
+            phones.append(phone)
+
+    conflicts = {name: by_name[name] for name, n in counts.items() if n > 1}
+    return by_name, conflicts
+
+
+@timed('excel.load_roster')
+def _load_roster() -> dict:
+    """
+    Состояние кэша: DataFrame, телефон → строки учеников, имя → телефоны.
+    Excel перечитывается только при изменении mtime/размера файла.
+    """
+    key = _file_key(EXCEL_WEEKLY)
+    if key is None:
+        return _EMPTY_ROSTER
+
+    with _roster_lock:
+        if _roster['key'] == key:
+            return dict(_roster)
+
+        df = pd.read_excel(EXCEL_WEEKLY, dtype={'Телефон родителя': str})
+        by_phone = {}
+        if 'Телефон родителя' in df.columns:
+            df['Телефон родителя'] = df['Телефон родителя'].astype(str).apply(clean_phone)
+            by_phone = {phone: rows for phone, rows in df.groupby('Телефон родителя', sort=False)}
+        by_name, conflicts = _build_name_index(df)
+        summaries = {}
+        for summary in weekly_summaries(df):
+            summaries.setdefault(summary['phone'], []).append(summary)
+
+        _roster.update(key=key, df=df, by_phone=by_phone, by_name=by_name, name_conflicts=conflicts,
+                       summaries=summaries)
+        return dict(_roster)
+
+
+def get_roster() -> Optional[pd.DataFrame]:
+    """Весь еженедельный список учеников (из кэша)."""
+    return _load_roster()['df']
+
+
+def get_student_summaries(phone: str) -> list:
+    """Готовые сводки (числа и подписи в процентах) по детям с этим номером родителя."""
+    if not phone:
+        return []
+    return _load_roster()['summaries'].get(clean_phone(phone), [])
+
+
+def get_name_conflicts() -> dict:
+    """Имена, которые встречаются в weekly.xlsx несколько раз: {имя: [телефоны]}."""
+    return _load_roster()['name_conflicts']
+
+# ──────────────────────── Готовые недельные сводки ────────────────────────
+# Текст /results и рассылки строится один раз после загрузки weekly.xlsx и хранится
+# в таблице weekly_snapshots и в памяти. Запрос родителя — поиск в словаре по телефону;
+# Excel перечитывается, только если файл изменился, а сводки ещё не перестроены.
+
+_snapshots_lock = threading.Lock()
+_snapshots_build_lock = threading.Lock()
+_snapshots = {'key': None, 'by_phone': {}}
+
+
+def _source_key(path: str) -> Optional[str]:
+    key = _file_key(path)
+    return None if key is None else f"{key[0]}:{key[1]}"
+
+
+def build_weekly_snapshots() -> int:
+    """
+    Пересчитывает сводки из weekly.xlsx и сохраняет их в БД и в памяти.
+    Возвращает число учеников.
+    """
+    with _snapshots_build_lock:
+        source = _source_key(EXCEL_WEEKLY)
+        snapshots = {}
+        for phone, items in _load_roster()['summaries'].items():
+            snapshots[phone] = [
+                dict(s, text=format_weekly_results(s['name'], s['labels']),
+                     broadcast=format_weekly_broadcast(s['name'], s['labels']))
+                for s in items
+            ]
+        if source is not None:
+            replace_weekly_snapshots(source, snapshots)
+        with _snapshots_lock:
+            _snapshots.update(key=source, by_phone=snapshots)
+        return sum(len(items) for items in snapshots.values())
+
+
+def get_weekly_snapshots(phone: str) -> list:
+    """
+    Готовые сводки по детям с этим номером родителя: {'name', 'text', 'broadcast',
+    'values', 'labels', 'valid'}. После перезапуска берутся из БД, без чтения Excel.
+    """
+    if not phone:
+        return []
+    source = _source_key(EXCEL_WEEKLY)
+    if source is None:
+        return []
+
+    with _snapshots_lock:
+        if _snapshots['key'] == source:
+            return _snapshots['by_phone'].get(clean_phone(phone), [])
+
+    # в памяти устарело: сначала сводки из БД, и только если они от другой версии файла — пересчёт
+    with _snapshots_build_lock:
+        if _snapshots['key'] != source:
+            stored_key, stored = load_weekly_snapshots()
+            if stored_key == source:
+                with _snapshots_lock:
+                    _snapshots.update(key=source, by_phone=stored)
+    if _snapshots['key'] != source:
+        build_weekly_snapshots()
+
+    with _snapshots_lock:
+        return _snapshots['by_phone'].get(clean_phone(phone), [])
 
 # ──────────────────────── Получение данных ученика из Excel ────────────────────────
 
 def get_student_data(phone: str) -> Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]:
     """
-    Загружает Excel-файл и находит строки с указанным номером.
+    Находит строки с указанным номером в кэшированном Excel-файле.
     Возвращает (весь DataFrame, только строки с нужным номером).
     """
-    if not phone or not os.path.exists(EXCEL_WEEKLY):
+    if not phone:
         return None, None
 
-    df = pd.read_excel(EXCEL_WEEKLY, dtype={'Телефон родителя': str})
+    roster = _load_roster()
+    df = roster['df']
+    if df is None:
+        return None, None
 
     if 'Телефон родителя' not in df.columns:
         return df, None
 
-    df['Телефон родителя'] = df['Телефон родителя'].astype(str).apply(clean_phone)
-    phone_clean = clean_phone(phone)
-
-    matched_rows = df[df['Телефон родителя'] == phone_clean]
+    matched_rows = roster['by_phone'].get(clean_phone(phone))
+    if matched_rows is None:
+        matched_rows = df.iloc[0:0]
     return df, matched_rows
 
-# ──────────────────────── Форматирование текста результата ────────────────────────
+# ──────────────────────── Потоковое чтение Excel ────────────────────────
+# openpyxl в режиме read_only разбирает лист построчно, не загружая его целиком.
+
+MONTHLY_FIRST_ROW = 4   # данные ежемесячного листа начинаются с 5-й строки
+MONTHLY_COLUMNS = {     # фиксированные номера колонок (с нуля)
+    'Имя ученика': 1,
+    'Таджикский язык': 4,
+    'Биология': 7,
+    'Химия': 10,
+    'Физика': 13,
+    'Общий балл': 14,
+    'Общий процент': 15,
+}
+WEEKLY_REQUIRED_COLUMNS = ('Имя ученика', 'Телефон родителя')
+
+
+def _iter_sheet_rows(path: str) -> Iterator[tuple]:
+    """Строки первого листа как кортежи значений."""
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from wb.worksheets[0].iter_rows(values_only=True)
+    finally:
+        wb.close()
 
-def format_results(name: str, data: pd.Series) -> str:
+
+def iter_weekly_sheet(path: Optional[str] = None) -> Iterator[dict]:
     """
-    Формирует текст для Telegram с результатами ученика.
+    Строки еженедельного файла как словари {заголовок: значение}.
+    Колонки без заголовка пропускаются. Без колонок WEEKLY_REQUIRED_COLUMNS — ValueError.
     """
-    subject_emojis = {
-        'таджикский язык': '📚',
-        'биология': '🌱',
-        'химия': '🧪',
-        'физика': '⚡️',
-        'общий процент': '📊'
-    }
-
-    results = data.drop(['Имя ученика', 'Телефон родителя'], errors='ignore')
-    results_percent = {}
+    rows = _iter_sheet_rows(path or EXCEL_WEEKLY)
+    header = next(rows, None)
+    if header is None:
+        return
+    columns = [(i, str(h).strip()) for i, h in enumerate(header) if h is not None and str(h).strip()]
+    missing = [col for col in WEEKLY_REQUIRED_COLUMNS if col not in {name for _, name in columns}]
+    if missing:
+        raise ValueError(f"в еженедельном файле нет колонок: {', '.join(missing)}")
 
-    for subject, mark in results.items():
-        subject_clean = subject.strip().lower()
-        try:
-            percent = float(mark)
-            results_percent[subject_clean] = (
-                f"{round(percent * 100)}%" if percent <= 1 else f"{round(percent)}%"
-            )
-        except (ValueError, TypeError):
-            results_percent[subject_clean] = str(mark)
+    for row in rows:
+        yield {name: (row[i] if i < len(row) else None) for i, name in columns}
 
-    text = f"*Результаты прошедшей недели для {name}:*\n\n"
-    for subject, mark in results_percent.items():
-        emoji = subject_emojis.get(subject, '🔹')
-        text += f"{emoji} {subject.capitalize()}: {mark}\n"
 
-    return text
+def iter_monthly_sheet(path: Optional[str] = None) -> Iterator[dict]:
+    """
+    Строки ежемесячного файла (фиксированная раскладка колонок), только с именем ученика.
+    Лист уже, чем нужно для MONTHLY_COLUMNS, — ValueError (загружен не тот файл).
+    """
+    width = max(MONTHLY_COLUMNS.values()) + 1
+    for n, row in enumerate(_iter_sheet_rows(path or EXCEL_MONTHLY)):
+        if n < MONTHLY_FIRST_ROW:
+            continue
+        if n == MONTHLY_FIRST_ROW and len(row) < width:
+            raise ValueError(f"в ежемесячном файле {len(row)} колонок, ожидается не меньше {width}")
+        record = {col: (row[i] if i < len(row) else None) for col, i in MONTHLY_COLUMNS.items()}
+        if record['Имя ученика'] is None or not str(record['Имя ученика']).strip():
+            continue
+        yield record
 
 # ──────────────────────── Загрузка ежемесячных данных из Excel ────────────────────────
 
+@timed('excel.load_monthly')
 def load_monthly_data(path: Optional[str] = None) -> pd.DataFrame:
     """
     Загружает ежемесячный Excel-файл и преобразует его в DataFrame.
@@ -92,36 +339,20 @@ def load_monthly_data(path: Optional[str] = None) -> pd.DataFrame:
     if not os.path.exists(path):
         return pd.DataFrame()
 
-    df = pd.read_excel(path, header=None)
-
-    data = {
-        'Имя ученика': df.loc[4:, 1],
-        'Таджикский язык': df.loc[4:, 4],
-        'Биология': df.loc[4:, 7],
-        'Химия': df.loc[4:, 10],
-        'Физика': df.loc[4:, 13],
-        'Общий балл': df.loc[4:, 14],
-        'Общий процент': df.loc[4:, 15],
-    }
-
-    result_df = pd.DataFrame(data)
-    result_df = result_df.dropna(subset=['Имя ученика']).reset_index(drop=True)
-    return result_df
+    return pd.DataFrame(list(iter_monthly_sheet(path)), columns=list(MONTHLY_COLUMNS), dtype=object)
 
 # ──────────────────────── Поиск chat_id по имени ученика ────────────────────────
 
-def find_chat_id_by_name(name: str, bindings: dict, student_df: pd.DataFrame) -> Optional[str]:
+def find_chat_ids_by_name(name: str) -> list:
     """
-    Находит chat_id по имени ученика, используя привязки и телефон.
+    Все chat_id родителей ученика: имя → телефоны (индекс по weekly.xlsx)
+    → chat_id (индекс по привязкам). Оба шага — поиск в словаре.
     """
-    matches = student_df[student_df['Имя ученика'].str.lower() == name.lower()]
-    if matches.empty:
-        return None
-
-    phone = matches.iloc[0]['Телефон родителя']
-    phone_clean = clean_phone(phone)
-
-    for chat_id, bound_phone in bindings.items():
-        if clean_phone(bound_phone) == phone_clean:
-            return chat_id
-    return None
+    phones = _load_roster()['by_name'].get(normalize_name(name), [])
+    _, by_phone = _bindings()
+    chat_ids = []
+    for phone in phones:
+        for chat_id in by_phone.get(phone, ()):
+            if chat_id not in chat_ids:
+                chat_ids.append(chat_id)
+    return chat_ids
@@ -0,0 +1,86 @@
+import asyncio
+import hmac
+import secrets
+
+from aiohttp import web
+from telebot import types
+
+from metrics import handle_metrics
+
+# ──────────────────────── Константы ────────────────────────
+WEBHOOK_PATH = '/webhook'
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+UPDATE_WORKERS = 32     # одновременно обрабатываемых обновлений
+QUEUE_SIZE = 1000       # при переполнении отвечаем 503 — Telegram повторит доставку
+
+# ──────────────────────── Приложение ────────────────────────
+
+def create_app(bot, secret: str, workers: int = UPDATE_WORKERS, queue_size: int = QUEUE_SIZE) -> web.Application:
+    """
+    HTTP-приложение для приёма обновлений от Telegram. Запрос проверяется
+    по секретному заголовку, кладётся в очередь и сразу подтверждается;
+    обработчики бота выполняют workers фоновых задач.
+    """
+    queue = asyncio.Queue(maxsize=queue_size)
+
+    async def handle_update(request):
+        # байты, а не str: compare_digest падает с TypeError на не-ASCII строках
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, '').encode(), secret.encode()):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(data, dict):  # Update от Telegram — всегда JSON-объект
+            return web.Response(status=400)
+        try:
+            queue.put_nowait(data)
+        except asyncio.QueueFull:
+            return web.Response(status=503)
+        return web.Response()
+
+    async def handle_health(request):
+        return web.Response(text="ok")
+
+    async def worker():
+        while True:
+            data = await queue.get()
+            try:
+                await bot.process_new_updates([types.Update.de_json(data)])
+            except Exception as e:
+                update_id = data.get('update_id') if isinstance(data, dict) else None
+                print(f"❌ Ошибка обработки обновления {update_id}: {e}")
+            finally:
+                queue.task_done()
+
+    async def start_workers(app):
+        app['workers'] = [asyncio.create_task(worker()) for _ in range(workers)]
+
+    async def stop_workers(app):
+        for task in app['workers']:
+            task.cancel()
+        await asyncio.gather(*app['workers'], return_exceptions=True)
+
+    app = web.Application()
+    app['queue'] = queue
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get('/', handle_health)  # заменяет keep-alive сервер в режиме webhook
+    app.router.add_get('/metrics', handle_metrics)
+    app.on_startup.append(start_workers)
+    app.on_cleanup.append(stop_workers)
+    return app
+
+
+async def run_webhook(bot, url: str, secret: str = None, host: str = '0.0.0.0', port: int = 8080):
+    """Поднимает HTTP-сервер, регистрирует webhook в Telegram и работает до отмены."""
+    secret = secret or secrets.token_urlsafe(32)
+    runner = web.AppRunner(create_app(bot, secret))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    await bot.set_webhook(url.rstrip('/') + WEBHOOK_PATH, secret_token=secret)
+    print(f"🌐 Webhook: {url.rstrip('/')}{WEBHOOK_PATH} (порт {port})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await bot.delete_webhook()
+        await runner.cleanup()